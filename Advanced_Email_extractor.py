@@ -1,19 +1,31 @@
 import os
 import base64
 import csv
+import argparse
 import json
 import logging
 import time
-import tkinter as tk
 from datetime import datetime
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from tkinter import messagebox, ttk
+from attachments import SPOOL_DIRNAME, AttachmentSpooler, link_blob
+from date_utils import day_key, internal_timestamp, message_timestamp
+from exporters import SHARD_DIRNAME, CalendarShards, JsonlWriter, ParquetStreamWriter
+from extractor_daemon import DEFAULT_SOCKET, job_request, print_events, run_or_submit, submit
+from gmail_api import build_query, profile_for_fields
+from gmail_client import build, get_credentials, preload
+from jobs import ACTIONS, SenderExport
+from message_store import open_store
+from metrics import metrics, recorded
+from profiling import profile_directory, profile_phase, profiled
+from progress import ProgressBus, queue_emitter
 from threading import Thread
 from queue import Queue
+try:
+    import tkinter as tk
+    from tkinter import messagebox, ttk
+except ImportError:
+    # Python builds without Tk (headless servers) still run the worker
+    # functions, e.g. as extraction daemon jobs
+    tk = messagebox = ttk = None
 
 # Scopes for Gmail API
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
@@ -25,11 +37,28 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Columns written by export_to_csv
+CSV_FIELDS = ['id', 'date', 'from', 'subject', 'body']
+
+# Columns written by full_extraction
+FULL_FIELDS = ['id', 'date', 'from', 'subject', 'body', 'html_body', 'attachments']
+
 def load_config():
     default_config = {
         'csv_directory': './emails',
         'max_retries': 3,
-        'default_action': 'export'
+        'default_action': 'export',
+        'fetch_workers': 4,
+        'decode_processes': 0,
+        'engine': 'threads',
+        'bulk_actions': True,
+        'incremental': False,
+        'csv_include_body': True,
+        'jsonl_gzip': False,
+        'parquet': False,
+        'metrics_report': '',
+        'prometheus_textfile': '',
+        'daemon_socket': ''
     }
     if os.path.exists('config.json'):
         with open('config.json', 'r') as f:
@@ -39,40 +68,7 @@ def load_config():
     return default_config
 
 def authenticate_gmail():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-def get_emails(service, sender_email, start_date=None, end_date=None, max_retries=3):
-    query = f'from:{sender_email}'
-    if start_date:
-        query += f' after:{start_date.strftime("%Y/%m/%d")}'
-    if end_date:
-        query += f' before:{end_date.strftime("%Y/%m/%d")}'
-    
-    for attempt in range(max_retries):
-        try:
-            results = service.users().messages().list(userId='me', q=query).execute()
-            return results.get('messages', [])
-        except HttpError as error:
-            if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                logging.warning(f"API error {error.resp.status}, retrying in {2 ** attempt}s")
-                time.sleep(2 ** attempt)
-                continue
-            logging.error(f"Failed to fetch emails: {error}")
-            return []
-        except Exception as e:
-            logging.error(f"Unexpected error fetching emails: {e}")
-            return []
+    return get_credentials(SCOPES)
 
 def get_message_body(payload):
     body = ''
@@ -84,53 +80,52 @@ def get_message_body(payload):
                     body += base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
                 elif 'parts' in part:
                     body += get_message_body(part)
-        elif 'data' in payload['body']:
+        elif 'data' in payload.get('body', {}):
             data = payload['body']['data']
             body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
     except Exception as e:
         logging.warning(f"Error decoding message body: {e}")
     return body
 
-def get_email_details(service, msg_id):
-    try:
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        headers = message['payload']['headers']
-        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
-        from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
-        date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
-        
-        # Plain text body
-        body_text = get_message_body(message['payload'])
-        
-        # HTML body and attachments
-        html_body = ''
-        attachments = []
-        if 'parts' in message['payload']:
-            for part in message['payload']['parts']:
-                if part['mimeType'] == 'text/html' and 'data' in part['body']:
-                    html_body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-                elif 'filename' in part and part['filename']:
-                    attachment = {
+def parse_email(message, spooler=None):
+    headers = message['payload']['headers']
+    subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
+    from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
+    date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
+    
+    # Plain text body
+    body_text = get_message_body(message['payload'])
+    
+    # HTML body and attachments
+    html_body = ''
+    attachments = []
+    if 'parts' in message['payload']:
+        for part in message['payload']['parts']:
+            if part['mimeType'] == 'text/html' and 'data' in part['body']:
+                html_body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
+            elif 'filename' in part and part['filename']:
+                if spooler:
+                    attachments.append(spooler.spool(message['id'], part))
+                else:
+                    # Without a spooler only the metadata is kept
+                    attachments.append({
                         'filename': part['filename'],
                         'mimeType': part['mimeType'],
-                        'data': base64.urlsafe_b64decode(part['body'].get('data', ''))
-                    }
-                    attachments.append(attachment)
-        elif message['payload']['mimeType'] == 'text/html' and 'data' in message['payload']['body']:
-            html_body = base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8', errors='ignore')
-        
-        return {
-            'id': msg_id,
-            'date': date,
-            'from': from_email,
-            'subject': subject,
-            'body': body_text,
-            'html_body': html_body,
-            'attachments': attachments
-        }
-    except Exception as e:
-        logging.error(f"Error getting email details for {msg_id}: {e}")
-        return None
+                        'size': part['body'].get('size', 0)
+                    })
+    elif message['payload'].get('mimeType') == 'text/html' and 'data' in message['payload'].get('body', {}):
+        html_body = base64.urlsafe_b64decode(message['payload']['body']['data']).decode('utf-8', errors='ignore')
+    
+    return {
+        'id': message['id'],
+        'date': date,
+        'timestamp': internal_timestamp(message),
+        'from': from_email,
+        'subject': subject,
+        'body': body_text,
+        'html_body': html_body,
+        'attachments': attachments
+    }
 
 def export_to_csv(emails, filename, progress_queue, sender_email):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
@@ -138,7 +133,7 @@ def export_to_csv(emails, filename, progress_queue, sender_email):
     
     with open(filename, 'a' if file_exists else 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        fieldnames = ['id', 'date', 'from', 'subject', 'body']
+        fieldnames = CSV_FIELDS
         dict_writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         
         if not file_exists:
@@ -146,60 +141,75 @@ def export_to_csv(emails, filename, progress_queue, sender_email):
             dict_writer.writeheader()
         
         total = len(emails)
-        for i, email in enumerate(emails, 1):
-            if email:
-                dict_writer.writerow({k: v for k, v in email.items() if k in fieldnames})
-                progress_queue.put(('progress', i / total * 100, f"Exporting {i}/{total} emails"))
+        bus = ProgressBus(queue_emitter(progress_queue))
+        with metrics.stage('export', total):
+            for i, email in enumerate(emails, 1):
+                if email:
+                    dict_writer.writerow({k: v for k, v in email.items() if k in fieldnames})
+                    bus.update('Exporting', i, total)
         progress_queue.put(('progress', 100, "Export complete"))
 
-def full_extraction(emails, sender_email, folder_path, progress_queue):
+def attachment_path(folder_path, msg_id, filename):
+    return os.path.join(folder_path, f"attachment_{msg_id}_{filename}")
+
+def full_extraction(emails, sender_email, folder_path, progress_queue, compress=False, parquet=False):
     os.makedirs(folder_path, exist_ok=True)
     csv_filename = os.path.join(folder_path, f"emails_from_{sender_email.replace(' ', '_')}.csv")
+    bus = ProgressBus(queue_emitter(progress_queue))
+    started = time.monotonic()
     
     # CSV Export
     with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        fieldnames = ['id', 'date', 'from', 'subject', 'body', 'html_body', 'attachments']
-        dict_writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        fieldnames = FULL_FIELDS
+        dict_writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
         writer.writerow([f"Sender: {sender_email}", f"Total Emails: {len(emails)}"])
         dict_writer.writeheader()
         total = len(emails)
         for i, email in enumerate(emails, 1):
             if email:
                 dict_writer.writerow({k: v if k != 'attachments' else str([a['filename'] for a in v]) for k, v in email.items()})
-                progress_queue.put(('progress', i / total * 50, f"Exporting CSV {i}/{total}"))
+                bus.update('Exporting CSV', i, total, 0, 50)
+        metrics.inc('bytes_written_total', csvfile.tell(), output='csv')
     
     # Save Attachments and Prepare HTML
-    emails_by_date = {}
+    shards = CalendarShards(os.path.join(folder_path, SHARD_DIRNAME))
+    # JSON Lines for ML, one message per line
+    jsonl = JsonlWriter(os.path.join(folder_path, 'emails.jsonl.gz' if compress else 'emails.jsonl'))
+    # Typed columns for pandas/duckdb when pyarrow is installed
+    parquet_writer = None
+    if parquet:
+        try:
+            parquet_writer = ParquetStreamWriter(os.path.join(folder_path, 'emails.parquet'), sender_email)
+        except RuntimeError as e:
+            logging.warning(f"Skipping Parquet export: {e}")
+    manifest = {}
     year_months = set()  # To store unique year-month combinations
     for i, email in enumerate(emails, 1):
-        try:
-            date_obj = datetime.strptime(email['date'], '%a, %d %b %Y %H:%M:%S %z')
-            date_key = date_obj.strftime('%Y-%m-%d')
-            year_month = date_obj.strftime('%Y-%m')
-            year_months.add(year_month)
-        except ValueError:
-            date_parts = email['date'].split()
-            if len(date_parts) >= 4:
-                date_str = f"{date_parts[3]}-{datetime.strptime(date_parts[2], '%b').month:02d}-{int(date_parts[1]):02d}"
-                date_key = date_str
-                year_month = date_str[:7]  # YYYY-MM
-                year_months.add(year_month)
-            else:
-                date_key = '1970-01-01'
-                year_months.add('1970-01')
-        
-        if date_key not in emails_by_date:
-            emails_by_date[date_key] = []
-        emails_by_date[date_key].append(email)
+        # Bucketed by local day from the cached timestamp, not the raw header
+        date_key = day_key(message_timestamp(email))
+        year_months.add(date_key[:7])
         
         for att in email['attachments']:
-            att_path = os.path.join(folder_path, f"attachment_{email['id']}_{att['filename']}")
-            with open(att_path, 'wb') as f:
-                f.write(att['data'])
+            att_path = attachment_path(folder_path, email['id'], att['filename'])
+            if att.get('path'):
+                # Links into the blob store instead of writing another copy
+                link_blob(att['path'], att_path)
+            else:
+                logging.warning(f"Attachment {att['filename']} of {email['id']} was not downloaded")
+            manifest.setdefault(email['id'], []).append({'filename': att['filename'], 'sha256': att.get('sha256'), 'size': att.get('size'), 'blob': att.get('path')})
             att['path'] = att_path
+        shards.add(date_key, email)
+        jsonl.write(dict(email, sender=sender_email, attachments=[{'filename': a['filename'], 'mimeType': a['mimeType'], 'sha256': a.get('sha256'), 'path': a['path']} for a in email['attachments']]))
+        if parquet_writer:
+            parquet_writer.write(email)
         
-        progress_queue.put(('progress', 50 + (i / total * 30), f"Processing attachments {i}/{total}"))
+        bus.update('Processing attachments', i, total, 50, 30)
+    
+    jsonl.close()
+    if parquet_writer:
+        parquet_writer.close()
+    emails_by_date = shards.finish()  # email count per day
     
     # Default to current month and year
     current_year, current_month = datetime.now().year, datetime.now().month
@@ -260,6 +270,8 @@ def full_extraction(emails, sender_email, folder_path, progress_queue):
         </style>
         <script>
             const emailsByDate = {1};
+            const loadedShards = {{}};
+            let pendingDate = null;
             const monthNames = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"];
             
             function generateCalendar(year, month) {{
@@ -285,10 +297,27 @@ def full_extraction(emails, sender_email, folder_path, progress_queue):
                 document.getElementById('calendar-title').innerText = `${{monthNames[month - 1]}} ${{year}} Calendar`;
             }}
             
+            function loadShard(month, days) {{
+                loadedShards[month] = days;
+                if (pendingDate && pendingDate.startsWith(month)) renderEmails(pendingDate);
+            }}
+            
+            function renderEmails(date) {{
+                const days = loadedShards[date.substring(0, 7)];
+                document.getElementById('email-list').innerHTML = (days[date] || []).join('');
+            }}
+            
             function showEmails(date) {{
-                document.querySelectorAll('.email-list').forEach(el => el.classList.remove('active'));
-                var emailList = document.getElementById('emails-' + date);
-                if (emailList) emailList.classList.add('active');
+                // Each month's emails live in {6}/YYYY-MM.js, loaded on first use
+                const month = date.substring(0, 7);
+                pendingDate = date;
+                if (loadedShards[month]) {{
+                    renderEmails(date);
+                    return;
+                }}
+                const script = document.createElement('script');
+                script.src = '{6}/' + month + '.js';
+                document.head.appendChild(script);
             }}
             
             function updateCalendar() {{
@@ -315,7 +344,7 @@ def full_extraction(emails, sender_email, folder_path, progress_queue):
                 <!-- Calendar will be generated here by JS -->
             </div>
         </div>
-        {6}
+        <div id="email-list" class="email-list active"></div>
     </body>
     </html>
     """.format(
@@ -325,134 +354,126 @@ def full_extraction(emails, sender_email, folder_path, progress_queue):
         initial_month,
         ''.join(f'<option value="{ym}"{" selected" if ym == default_year_month else ""}>{calendar.month_name[int(ym.split("-")[1])]} {ym.split("-")[0]}</option>' for ym in year_month_list),
         month_name,
-        ''.join([
-            f'<div id="emails-{date}" class="email-list">' +
-            ''.join([
-                '<div class="email-container">' +
-                f'<h3>{e["subject"]}</h3>' +
-                f'<p>{e["html_body"] or e["body"]}</p>' +
-                ''.join(f'<p>Attachment: <a href="{a["path"]}" download>{a["filename"]}</a></p>' for a in e["attachments"]) +
-                '</div>'
-                for e in sorted(emails_by_date[date], key=lambda x: x["date"], reverse=True)
-            ]) +
-            '</div>'
-            for date in sorted(emails_by_date.keys())
-        ])
+        SHARD_DIRNAME
     )
     
     with open(os.path.join(folder_path, 'emails.html'), 'w', encoding='utf-8') as f:
         f.write(html_content)
     
-    # JSON for ML
-    json_data = {
-        'sender': sender_email,
-        'total_emails': len(emails),
-        'emails': [{k: v if k != 'attachments' else [{'filename': a['filename'], 'mimeType': a['mimeType'], 'path': a['path']} for a in v] for k, v in email.items()} for email in emails]
-    }
-    with open(os.path.join(folder_path, 'emails.json'), 'w', encoding='utf-8') as f:
-        json.dump(json_data, f, indent=2)
+    # Message id -> blobs, so duplicates can be found without hashing files
+    with open(os.path.join(folder_path, 'attachments_manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
     
+    metrics.stage_done('full_extraction', time.monotonic() - started, total)
     progress_queue.put(('progress', 100, "Full extraction complete"))
 
-def read_existing_ids(filename):
-    if not os.path.isfile(filename):
-        return set()
-    
-    existing_ids = set()
-    try:
-        with open(filename, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                existing_ids.add(row['id'])
-    except Exception as e:
-        logging.error(f"Error reading existing CSV: {e}")
-    return existing_ids
-
-def delete_or_archive_emails(service, messages, action='delete', max_retries=3, progress_queue=None):
-    total = len(messages)
-    for i, msg in enumerate(messages, 1):
-        for attempt in range(max_retries):
-            try:
-                if action.lower() == 'delete':
-                    service.users().messages().trash(userId='me', id=msg['id']).execute()
-                elif action.lower() == 'archive':
-                    service.users().messages().modify(
-                        userId='me',
-                        id=msg['id'],
-                        body={'removeLabelIds': ['INBOX']}
-                    ).execute()
-                if progress_queue:
-                    progress_queue.put(('progress', i / total * 100, f"{action.capitalize()}ing {i}/{total} emails"))
-                break
-            except HttpError as error:
-                if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                logging.error(f"Failed to {action} email {msg['id']}: {error}")
-                break
-            except Exception as e:
-                logging.error(f"Unexpected error in {action} for {msg['id']}: {e}")
-                break
-    if progress_queue:
-        progress_queue.put(('progress', 100, f"{action.capitalize()} complete"))
-
 def process_emails_thread(sender_email, start_date, end_date, choice, mode, config, progress_queue):
     folder_path = os.path.join(config['csv_directory'], f"emails_from_{sender_email.replace(' ', '_')}")
     csv_filename = os.path.join(folder_path if mode == 'full' else config['csv_directory'], f"emails_from_{sender_email.replace(' ', '_')}.csv")
     
     progress_queue.put(('status', 0, "Authenticating..."))
+    # Per-message counters are coalesced into a few queue items a second
+    bus = ProgressBus(queue_emitter(progress_queue))
     logging.info(f"Starting email processing for {sender_email}")
     creds = authenticate_gmail()
     service = build('gmail', 'v1', credentials=creds)
     
     progress_queue.put(('status', 10, "Fetching emails..."))
-    messages = get_emails(service, sender_email, start_date, end_date)
+    # An interrupted run of the same job resumes from its journal; opening it
+    # cuts the simple-mode CSV back to the last committed page. Full mode only
+    # streams into the store and rebuilds its folder at the end.
+    preamble = lambda: [f"Sender: {sender_email}", f"Total Emails: {export.total}"]
+    export = SenderExport(creds, service, sender_email, build_query(sender_email, start_date, end_date), csv_filename, CSV_FIELDS, config, directory=config['csv_directory'], dated=bool(start_date or end_date), key_parts=(mode,), write_csv=mode == 'simple', preamble=preamble)
+    if export.journal.resumed:
+        progress_queue.put(('status', 10, f"Resuming after {len(export.journal.listed)} listed messages..."))
+    
+    # Request only what the selected exporter writes
+    fields = FULL_FIELDS if mode == 'full' else CSV_FIELDS
+    if mode == 'simple' and not config.get('csv_include_body', True):
+        fields = [field for field in fields if field != 'body']
+    # Full mode writes attachments to disk as they are fetched; simple mode
+    # never exports them, so it skips the downloads
+    spooler = AttachmentSpooler(creds, os.path.join(config['csv_directory'], SPOOL_DIRNAME)) if mode == 'full' else None
+    # Attachment spooling downloads while parsing, so only simple mode can
+    # hand decoding to worker processes
+    parse = (lambda message: parse_email(message, spooler)) if spooler else parse_email
+    decode_processes = 0 if spooler else None
+    
+    # Each record goes to the store as soon as it is fetched; simple mode also
+    # appends it to the CSV right away so a crash keeps what was written
+    profile_phase('fetch')
+    messages = export.fetch(parse, profile_for_fields(fields), lambda stage, done, total: bus.update(stage, done, total, 10, 50), decode_processes)
+    if spooler:
+        # The fetch threads are done with their clients
+        spooler.close()
+    
     if not messages:
         progress_queue.put(('complete', 0, f"No emails found from {sender_email}", "info"))
         logging.info(f"No emails found from {sender_email}")
+        export.finish()
         return
     
-    existing_ids = read_existing_ids(csv_filename)
-    new_emails = []
-    total_messages = len(messages)
-    
-    for i, msg in enumerate(messages, 1):
-        if msg['id'] not in existing_ids:
-            email_details = get_email_details(service, msg['id'])
-            if email_details:
-                new_emails.append(email_details)
-        progress_queue.put(('progress', (i / total_messages) * 50 + 10, f"Processing {i}/{total_messages} messages"))
-    
-    if new_emails:
+    # A resumed full run rebuilds the folder even if every message was
+    # fetched before the interruption
+    if export.new_ids or (export.journal.resumed and mode == 'full'):
         if mode == 'simple':
-            export_to_csv(new_emails, csv_filename, progress_queue, sender_email)
-            progress_queue.put(('complete', 100, f"Exported {len(new_emails)} new emails to {csv_filename}", "success"))
-            logging.info(f"Exported {len(new_emails)} new emails to {csv_filename}")
+            progress_queue.put(('progress', 100, "Export complete"))
+            progress_queue.put(('complete', 100, f"Exported {len(export.new_ids)} new emails to {csv_filename}", "success"))
+            logging.info(f"Exported {len(export.new_ids)} new emails to {csv_filename}")
         else:  # full
-            full_extraction(new_emails, sender_email, folder_path, progress_queue)
+            # full_extraction rewrites the folder, so include every stored email
+            profile_phase('export')
+            with open_store(config['csv_directory']) as store:
+                full_extraction(store.select(sender_email, start_date, end_date), sender_email, folder_path, progress_queue, config.get('jsonl_gzip'), config.get('parquet'))
             progress_queue.put(('complete', 100, f"Full extraction completed for {sender_email}", "success"))
             logging.info(f"Full extraction completed for {sender_email}")
     else:
         progress_queue.put(('complete', 100, "No new emails found", "info"))
         logging.info("No new emails found")
     
-    if choice == '2':
-        delete_or_archive_emails(service, messages, 'delete', progress_queue=progress_queue)
-        progress_queue.put(('complete', 100, "Emails deleted", "success"))
-        logging.info("Emails deleted")
-    elif choice == '3':
-        delete_or_archive_emails(service, messages, 'archive', progress_queue=progress_queue)
-        progress_queue.put(('complete', 100, "Emails archived", "success"))
-        logging.info("Emails archived")
+    profile_phase('action')
+    action = ACTIONS.get(choice)
+    export.finish(action, bus.update)
+    if action:
+        progress_queue.put(('complete', 100, f"Emails {action}d", "success"))
+        logging.info(f"Emails {action}d")
+
+def reexport_thread(sender_email, start_date, end_date, mode, config, progress_queue):
+    # Regenerates the exports from the local store without calling the API
+    suffix = ''
+    if start_date or end_date:
+        suffix = f"_{start_date.strftime('%Y%m%d') if start_date else 'start'}_{end_date.strftime('%Y%m%d') if end_date else 'end'}"
+    folder_path = os.path.join(config['csv_directory'], f"emails_from_{sender_email.replace(' ', '_')}{suffix}")
+    csv_filename = os.path.join(config['csv_directory'], f"emails_from_{sender_email.replace(' ', '_')}{suffix}.csv")
+    
+    progress_queue.put(('status', 0, "Reading local store..."))
+    with open_store(config['csv_directory']) as store:
+        emails = store.select(sender_email, start_date, end_date)
+        if not emails:
+            progress_queue.put(('complete', 0, f"No stored emails from {sender_email}", "info"))
+            return
+        profile_phase('export')
+        if mode == 'simple':
+            if os.path.isfile(csv_filename):
+                os.remove(csv_filename)
+            export_to_csv(emails, csv_filename, progress_queue, sender_email)
+            progress_queue.put(('complete', 100, f"Re-exported {len(emails)} emails to {csv_filename}", "success"))
+        else:
+            full_extraction(emails, sender_email, folder_path, progress_queue, config.get('jsonl_gzip'), config.get('parquet'))
+            progress_queue.put(('complete', 100, f"Full extraction regenerated for {sender_email}", "success"))
+    logging.info(f"Re-exported stored emails for {sender_email}")
 
 class GmailBotGUI:
-    def __init__(self, root):
+    def __init__(self, root, profile=False, daemon_socket=None):
         self.root = root
         self.root.title("Gmail Bot")
         self.config = load_config()
         self.progress_queue = Queue()
+        self.profile = profile
+        self.daemon_socket = daemon_socket or self.config.get('daemon_socket')
         
         self.create_widgets()
+        self.root.bind('<Control-Shift-P>', self.toggle_profiling)
         self.check_queue()
         
     def create_widgets(self):
@@ -480,7 +501,10 @@ class GmailBotGUI:
         tk.Radiobutton(self.root, text="Export and Archive", variable=self.action_var, value="3").grid(row=7, column=1, sticky='w')
         
         self.process_button = tk.Button(self.root, text="Process Emails", command=self.start_processing)
-        self.process_button.grid(row=8, column=0, columnspan=2, pady=10)
+        self.process_button.grid(row=8, column=0, pady=10)
+        
+        self.reexport_button = tk.Button(self.root, text="Re-export from Local Store", command=self.start_reexport)
+        self.reexport_button.grid(row=8, column=1, pady=10, sticky='w')
         
         self.progress_bar = ttk.Progressbar(self.root, length=300, mode='determinate')
         self.progress_bar.grid(row=9, column=0, columnspan=2, pady=5)
@@ -488,25 +512,38 @@ class GmailBotGUI:
         self.status_label = tk.Label(self.root, text="Ready")
         self.status_label.grid(row=10, column=0, columnspan=2, pady=5)
         
+    def toggle_profiling(self, event=None):
+        # Hidden switch (Ctrl+Shift+P): profile the next runs
+        self.profile = not self.profile
+        self.status_label.config(text=f"Profiling {'on' if self.profile else 'off'}")
+    
+    def profile_directory(self):
+        return profile_directory(self.config['csv_directory'], 'Advanced_Email_extractor') if self.profile else None
+    
     def update_progress(self, value, message):
         self.progress_bar['value'] = value
         self.status_label.config(text=message)
         self.root.update_idletasks()
 
     def check_queue(self):
+        # Drain everything queued since the last tick but redraw only the
+        # latest progress or status
+        latest = None
         while not self.progress_queue.empty():
             msg_type, value, message, *args = self.progress_queue.get()
-            if msg_type == 'progress':
-                self.update_progress(value, message)
+            if msg_type in ('progress', 'status'):
+                latest = (value, message)
             elif msg_type == 'complete':
+                latest = None
                 self.update_progress(value, "Process complete")
                 self.process_button.config(state='normal')
+                self.reexport_button.config(state='normal')
                 if args[0] == "success":
                     messagebox.showinfo("Success", message)
                 elif args[0] == "info":
                     messagebox.showinfo("Info", message)
-            elif msg_type == 'status':
-                self.update_progress(value, message)
+        if latest:
+            self.update_progress(*latest)
         self.root.after(100, self.check_queue)
 
     def start_processing(self):
@@ -528,12 +565,71 @@ class GmailBotGUI:
         mode = self.mode_var.get()
         
         self.process_button.config(state='disabled')
-        thread = Thread(target=process_emails_thread, args=(sender_email, start_date, end_date, choice, mode, self.config, self.progress_queue))
+        run = recorded(profiled(process_emails_thread, self.profile_directory()), self.config.get('metrics_report'), self.config.get('prometheus_textfile'), script='Advanced_Email_extractor')
+        # With a daemon socket a running daemon takes the job; otherwise it runs here
+        request = job_request(mode, [sender_email], start_date, end_date, choice, self.profile)
+        thread = Thread(target=run_or_submit, args=(self.daemon_socket, request, self.progress_queue, run, (sender_email, start_date, end_date, choice, mode, self.config, self.progress_queue)))
         thread.start()
 
+    def start_reexport(self):
+        sender_email = self.sender_entry.get()
+        if not sender_email:
+            messagebox.showerror("Error", "Please enter a sender email")
+            return
+        
+        start_date_str = self.start_date_entry.get()
+        end_date_str = self.end_date_entry.get()
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+        except ValueError:
+            messagebox.showerror("Error", "Invalid date format. Use YYYY-MM-DD")
+            return
+        
+        mode = self.mode_var.get()
+        
+        self.reexport_button.config(state='disabled')
+        thread = Thread(target=recorded(profiled(reexport_thread, self.profile_directory()), self.config.get('metrics_report'), self.config.get('prometheus_textfile'), script='Advanced_Email_extractor'), args=(sender_email, start_date, end_date, mode, self.config, self.progress_queue))
+        thread.start()
+
+def submit_to_daemon(args):
+    # Thin client: a warm daemon (python -m extractor_daemon) runs the job
+    # and no window is opened
+    start_date = datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    end_date = datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    try:
+        events = submit(job_request(args.mode, [args.sender], start_date, end_date, args.choice, args.profile), args.daemon)
+    except OSError as e:
+        print(f"No extraction daemon on {args.daemon}: {e}")
+        return 1
+    return 0 if print_events(events) else 1
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gmail extractor with simple and full extraction modes.")
+    parser.add_argument('--profile', action='store_true', help="write cProfile and tracemalloc reports to <csv_directory>/profiles for every run")
+    parser.add_argument('--daemon', nargs='?', const='', metavar='SOCKET', help=f"hand jobs to a running extraction daemon (default: daemon_socket from config.json, else {DEFAULT_SOCKET})")
+    parser.add_argument('--sender', help="with --daemon, submit this sender's job from the command line instead of opening the window")
+    parser.add_argument('--mode', choices=['simple', 'full'], default='simple')
+    parser.add_argument('--choice', choices=['1', '2', '3'], default='1', help="1 export, 2 export and delete, 3 export and archive")
+    parser.add_argument('--start', help="start date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="end date (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if args.sender and args.daemon is None:
+        parser.error("--sender needs --daemon")
+    return args
+
 def main():
+    args = parse_args()
+    if args.daemon is not None:
+        args.daemon = args.daemon or load_config().get('daemon_socket') or DEFAULT_SOCKET
+        if args.sender:
+            raise SystemExit(submit_to_daemon(args))
+    if tk is None:
+        raise SystemExit("The GUI needs tkinter (python3-tk); use the extraction daemon or Full_extractor on this host")
     root = tk.Tk()
-    app = GmailBotGUI(root)
+    app = GmailBotGUI(root, profile=args.profile, daemon_socket=args.daemon)
+    # The window is up first; the Google client loads behind it
+    root.after_idle(preload)
     root.mainloop()
 
 if __name__ == '__main__':
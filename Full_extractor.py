@@ -1,15 +1,22 @@
+import argparse
 import os
 import base64
 import csv
 import json
 import logging
-import time
 from datetime import datetime
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
+from batch_jobs import build_sender_queries, iter_batch_pages, match_sender, read_senders_file, unique_senders
+from date_utils import internal_timestamp
+from exporters import CsvStreamWriter, csv_ids
+from extractor_daemon import DEFAULT_SOCKET, job_request, print_events, submit
+from gmail_api import build_query, profile_for_fields
+from gmail_client import build, get_credentials
+from history_sync import STATE_FILENAME, get_history_id, save_checkpoint
+from jobs import ACTIONS, JobJournal, SenderExport, apply_action, fetch_new_emails, job_path, keep_checkpoint, open_engine, unfetched
+from message_store import open_store
+from metrics import metrics, recorded_run
+from profiling import profile_directory, profile_phase, profiled_run
+from progress import ProgressBus, print_emitter
 
 # Scopes for Gmail API
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
@@ -21,11 +28,23 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Columns written by export_to_csv
+CSV_FIELDS = ['id', 'date', 'from', 'subject', 'body']
+
 def load_config():
     default_config = {
         'csv_directory': './emails',
         'max_retries': 3,
-        'default_action': 'export'
+        'default_action': 'export',
+        'fetch_workers': 4,
+        'decode_processes': 0,
+        'engine': 'threads',
+        'bulk_actions': True,
+        'incremental': False,
+        'csv_include_body': True,
+        'metrics_report': '',
+        'prometheus_textfile': '',
+        'daemon_socket': ''
     }
     if os.path.exists('config.json'):
         with open('config.json', 'r') as f:
@@ -35,40 +54,7 @@ def load_config():
     return default_config
 
 def authenticate_gmail():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-def get_emails(service, sender_email, start_date=None, end_date=None, max_retries=3):
-    query = f'from:{sender_email}'
-    if start_date:
-        query += f' after:{start_date.strftime("%Y/%m/%d")}'
-    if end_date:
-        query += f' before:{end_date.strftime("%Y/%m/%d")}'
-    
-    for attempt in range(max_retries):
-        try:
-            results = service.users().messages().list(userId='me', q=query).execute()
-            return results.get('messages', [])
-        except HttpError as error:
-            if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                logging.warning(f"API error {error.resp.status}, retrying in {2 ** attempt}s")
-                time.sleep(2 ** attempt)
-                continue
-            logging.error(f"Failed to fetch emails: {error}")
-            return []
-        except Exception as e:
-            logging.error(f"Unexpected error fetching emails: {e}")
-            return []
+    return get_credentials(SCOPES)
 
 def get_message_body(payload):
     body = ''
@@ -80,90 +66,126 @@ def get_message_body(payload):
                     body += base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
                 elif 'parts' in part:
                     body += get_message_body(part)
-        elif 'data' in payload['body']:
+        elif 'data' in payload.get('body', {}):
             data = payload['body']['data']
             body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
     except Exception as e:
         logging.warning(f"Error decoding message body: {e}")
     return body
 
-def get_email_details(service, msg_id):
-    try:
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        headers = message['payload']['headers']
-        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
-        from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
-        date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
-        body = get_message_body(message['payload'])
-        
-        return {
-            'id': msg_id,
-            'date': date,
-            'from': from_email,
-            'subject': subject,
-            'body': body
-        }
-    except Exception as e:
-        logging.error(f"Error getting email details for {msg_id}: {e}")
-        return None
+def parse_email(message):
+    headers = message['payload']['headers']
+    subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
+    from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
+    date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
+    body = get_message_body(message['payload'])
+    
+    return {
+        'id': message['id'],
+        'date': date,
+        'timestamp': internal_timestamp(message),
+        'from': from_email,
+        'subject': subject,
+        'body': body
+    }
 
 def export_to_csv(emails, filename):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     file_exists = os.path.isfile(filename)
     
     with open(filename, 'a' if file_exists else 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['id', 'date', 'from', 'subject', 'body']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        fieldnames = CSV_FIELDS
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
         
         if not file_exists:
             writer.writeheader()
         
         total = len(emails)
-        for i, email in enumerate(emails, 1):
-            if email:  # Skip if email details couldn't be fetched
-                writer.writerow(email)
-                print(f"Exporting {i}/{total} emails", end='\r')
+        bus = ProgressBus(print_emitter)
+        with metrics.stage('export', total):
+            for i, email in enumerate(emails, 1):
+                if email:  # Skip if email details couldn't be fetched
+                    writer.writerow(email)
+                    bus.update('Exporting', i, total)
         print()  # New line after completion
 
 def read_existing_ids(filename):
-    if not os.path.isfile(filename):
-        return set()
-    
-    existing_ids = set()
+    # Only the rows appended since the last read are parsed when the file
+    # was read earlier in this process
     try:
-        with open(filename, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                existing_ids.add(row['id'])
+        return csv_ids.read(filename)
     except Exception as e:
         logging.error(f"Error reading existing CSV: {e}")
-    return existing_ids
-
-def delete_or_archive_emails(service, messages, action='delete', max_retries=3):
-    for msg in messages:
-        for attempt in range(max_retries):
-            try:
-                if action.lower() == 'delete':
-                    service.users().messages().trash(userId='me', id=msg['id']).execute()
-                elif action.lower() == 'archive':
-                    service.users().messages().modify(
-                        userId='me',
-                        id=msg['id'],
-                        body={'removeLabelIds': ['INBOX']}
-                    ).execute()
-                break
-            except HttpError as error:
-                if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                logging.error(f"Failed to {action} email {msg['id']}: {error}")
-                break
-            except Exception as e:
-                logging.error(f"Unexpected error in {action} for {msg['id']}: {e}")
-                break
+        return set()
+
+def fetch_profile(config):
+    # Request only what the CSV export writes
+    fields = CSV_FIELDS if config.get('csv_include_body', True) else [field for field in CSV_FIELDS if field != 'body']
+    return profile_for_fields(fields)
+
+def csv_path(config, sender_email):
+    return os.path.join(config['csv_directory'], f"emails_from_{sender_email.split('@')[0]}.csv")
+
+def reexport_to_csv(sender_email, start_date, end_date, config):
+    # Rebuilds the CSV from the local store without calling the API
+    suffix = ''
+    if start_date or end_date:
+        suffix = f"_{start_date.strftime('%Y%m%d') if start_date else 'start'}_{end_date.strftime('%Y%m%d') if end_date else 'end'}"
+    csv_filename = os.path.join(config['csv_directory'], f"emails_from_{sender_email.split('@')[0]}{suffix}.csv")
+    
+    with open_store(config['csv_directory']) as store:
+        emails = store.select(sender_email, start_date, end_date)
+        if not emails:
+            print(f"No stored emails from {sender_email}")
+            return
+        if os.path.isfile(csv_filename):
+            os.remove(csv_filename)
+        profile_phase('export')
+        export_to_csv(emails, csv_filename)
+        print(f"Re-exported {len(emails)} emails to {csv_filename}")
+        logging.info(f"Re-exported {len(emails)} emails to {csv_filename}")
 
 def main():
     config = load_config()
+    args = parse_args()
+    if args.daemon is not None:
+        args.daemon = args.daemon or config.get('daemon_socket') or DEFAULT_SOCKET
+        raise SystemExit(submit_to_daemon(args))
+    # Per-stage timings and API counters, written when the run ends
+    # --profile writes cProfile and tracemalloc reports per phase
+    profile_dir = profile_directory(config['csv_directory'], 'Full_extractor') if args.profile else None
+    with recorded_run(args.metrics_report or config.get('metrics_report'), args.prometheus_textfile or config.get('prometheus_textfile'), script='Full_extractor'), profiled_run(profile_dir):
+        run(config, args)
+    if profile_dir:
+        print(f"Profiles written to {profile_dir}")
+
+def batch_job(args):
+    senders = list(args.batch or [])
+    if args.batch_file:
+        senders += read_senders_file(args.batch_file)
+    start_date = datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    end_date = datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    return senders, start_date, end_date
+
+def submit_to_daemon(args):
+    # Thin client: a warm daemon (python -m extractor_daemon) runs the batch
+    # and its output is shown here
+    if not (args.batch or args.batch_file):
+        print("--daemon needs --batch or --batch-file")
+        return 2
+    senders, start_date, end_date = batch_job(args)
+    try:
+        events = submit(job_request('batch', unique_senders(senders), start_date, end_date, args.choice, args.profile), args.daemon)
+    except OSError as e:
+        print(f"No extraction daemon on {args.daemon}: {e}")
+        return 1
+    return 0 if print_events(events) else 1
+
+def run(config, args):
+    if args.batch or args.batch_file:
+        senders, start_date, end_date = batch_job(args)
+        process_batch(senders, start_date, end_date, args.choice, config)
+        return
     
     # User inputs
     sender_email = input("Enter the sender's email address: ")
@@ -177,52 +199,155 @@ def main():
     print("1. Just export emails to CSV")
     print("2. Export and delete emails")
     print("3. Export and archive emails")
-    choice = input("Enter your choice (1-3): ")
+    print("4. Re-export stored emails to CSV (no API calls)")
+    choice = input("Enter your choice (1-4): ")
+    
+    csv_filename = csv_path(config, sender_email)
     
-    csv_filename = os.path.join(config['csv_directory'], f"emails_from_{sender_email.split('@')[0]}.csv")
+    if choice == '4':
+        reexport_to_csv(sender_email, start_date, end_date, config)
+        return
     
     # Authenticate and build service
     logging.info(f"Starting email processing for {sender_email}")
     creds = authenticate_gmail()
     service = build('gmail', 'v1', credentials=creds)
 
-    # Get emails
-    messages = get_emails(service, sender_email, start_date, end_date)
+    # Get emails page by page, processing each page as soon as it is listed
+    export = SenderExport(creds, service, sender_email, build_query(sender_email, start_date, end_date), csv_filename, CSV_FIELDS, config, dated=bool(start_date or end_date))
+    if export.journal.resumed:
+        print(f"Resuming interrupted export after {len(export.journal.listed)} listed messages")
+    # Each record is written to the store and appended to the CSV as soon as
+    # it is fetched, so memory stays flat and a crash keeps what was written
+    profile_phase('fetch')
+    bus = ProgressBus(print_emitter)
+    messages = export.fetch(parse_email, fetch_profile(config), bus.update)
+    print()
+
     if not messages:
         print(f"No emails found from {sender_email}")
         logging.info(f"No emails found from {sender_email}")
+        export.finish()
         return
 
-    # Process emails
-    existing_ids = read_existing_ids(csv_filename)
-    new_emails = []
-    
-    total_messages = len(messages)
-    for i, msg in enumerate(messages, 1):
-        if msg['id'] not in existing_ids:
-            email_details = get_email_details(service, msg['id'])
-            if email_details:
-                new_emails.append(email_details)
-        print(f"Processing {i}/{total_messages} messages", end='\r')
-    print()
-
-    if new_emails:
-        export_to_csv(new_emails, csv_filename)
-        print(f"Exported {len(new_emails)} new emails to {csv_filename}")
-        logging.info(f"Exported {len(new_emails)} new emails to {csv_filename}")
+    if export.new_ids:
+        print(f"Exported {len(export.new_ids)} new emails to {csv_filename}")
+        logging.info(f"Exported {len(export.new_ids)} new emails to {csv_filename}")
     else:
         print("No new emails found")
         logging.info("No new emails found")
 
     # Handle delete/archive option
-    if choice == '2':
-        delete_or_archive_emails(service, messages, 'delete')
-        print("Emails deleted")
-        logging.info("Emails deleted")
-    elif choice == '3':
-        delete_or_archive_emails(service, messages, 'archive')
-        print("Emails archived")
-        logging.info("Emails archived")
+    profile_phase('action')
+    action = ACTIONS.get(choice)
+    export.finish(action, bus.update)
+    if action:
+        print()
+        print(f"Emails {action}d")
+        logging.info(f"Emails {action}d")
+
+def process_batch(senders, start_date, end_date, choice, config):
+    # Exports several senders in one run: one login, one Gmail client pool
+    # and one fetch stage. Senders are listed together through OR queries and
+    # each fetched message is routed to its sender's CSV by the From header.
+    senders = unique_senders(senders)
+    logging.info(f"Starting batch processing for {len(senders)} senders")
+    creds = authenticate_gmail()
+    service = build('gmail', 'v1', credentials=creds)
+
+    csv_filenames = {sender: csv_path(config, sender) for sender in senders}
+    queries = build_sender_queries(senders, start_date, end_date)
+    journal = JobJournal(job_path(config['csv_directory'], *queries, *sorted(set(csv_filenames.values()))), set(csv_filenames.values())).open()
+    if journal.resumed:
+        print(f"Resuming interrupted batch after {len(journal.listed)} listed messages")
+    existing_ids = set()
+    for filename in set(csv_filenames.values()):
+        existing_ids |= read_existing_ids(filename)
+    # A full listing brings every sender up to date, so their checkpoints
+    # can move forward for later incremental runs; a date range does not
+    state_file = os.path.join(config['csv_directory'], STATE_FILENAME)
+    history_id = get_history_id(service) if config.get('incremental') and not (start_date or end_date) else None
+    new_counts = {sender: 0 for sender in senders}
+    fetched = []
+
+    profile = fetch_profile(config)
+    engine = open_engine(creds, parse_email, profile, config)
+    bus = ProgressBus(print_emitter)
+    # Senders whose addresses share a local part share a CSV, so writers are
+    # per file; two writers appending to one file would overwrite each other
+    csv_writers = {filename: CsvStreamWriter(filename, CSV_FIELDS) for filename in set(csv_filenames.values())}
+    profile_phase('fetch')
+    with open_store(config['csv_directory']) as store:
+        def save_record(email_details):
+            fetched.append(email_details['id'])
+            sender = match_sender(email_details.get('from'), senders)
+            if sender is None:
+                return
+            store.add(email_details, sender)
+            csv_writers[csv_filenames[sender]].write(email_details)
+            new_counts[sender] += 1
+            journal.record_written(email_details['id'])
+
+        def sync_outputs():
+            for csv_writer in csv_writers.values():
+                csv_writer.flush(sync=True)
+            store.flush()
+
+        journal.sync = sync_outputs
+        try:
+            pages = journal.track(iter_batch_pages(service, queries, page_token=journal.page_token), existing_ids)
+            listed = fetch_new_emails(creds, engine, pages, existing_ids, parse_email, profile, config, save_record, bus.update)
+            print()
+            journal.complete()
+        finally:
+            for csv_writer in csv_writers.values():
+                csv_writer.close()
+
+    for sender in senders:
+        if new_counts[sender]:
+            print(f"Exported {new_counts[sender]} new emails to {csv_filenames[sender]}")
+            logging.info(f"Exported {new_counts[sender]} new emails to {csv_filenames[sender]}")
+        else:
+            print(f"No new emails found from {sender}")
+    messages = journal.messages(listed)
+    missing = len(unfetched(listed, existing_ids, fetched))
+    if history_id and journal.listing_done and not missing:
+        for sender in senders:
+            save_checkpoint(state_file, sender, history_id)
+    elif history_id:
+        keep_checkpoint(', '.join(senders), journal.listing_done, missing)
+
+    action = ACTIONS.get(choice)
+    if action:
+        # Messages no sender matched, or whose fetch failed, are in no CSV
+        # and are left in the mailbox
+        exported = set()
+        for filename in csv_writers:
+            exported |= read_existing_ids(filename)
+        skipped = sum(1 for msg in messages if msg['id'] not in exported)
+        if skipped:
+            logging.warning(f"Not applying {action} to {skipped} emails that were not exported")
+        messages = [msg for msg in messages if msg['id'] in exported]
+    if messages and action:
+        profile_phase('action')
+        apply_action(service, engine, messages, action, config, bus.update)
+        print()
+        print(f"Emails {action}d")
+        logging.info(f"Emails {action}d")
+    journal.finish()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export Gmail messages to CSV. Without arguments the options are asked interactively.")
+    parser.add_argument('--batch', nargs='+', metavar='SENDER', help="export several senders in one run")
+    parser.add_argument('--batch-file', help="file with one sender per line")
+    parser.add_argument('--start', help="start date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="end date (YYYY-MM-DD)")
+    parser.add_argument('--choice', choices=['1', '2', '3'], default='1', help="1 export, 2 export and delete, 3 export and archive")
+    parser.add_argument('--metrics-report', help="write a JSON run report here ({timestamp} is replaced)")
+    parser.add_argument('--prometheus-textfile', help="write run metrics here for node_exporter's textfile collector")
+    parser.add_argument('--profile', action='store_true', help="write cProfile and tracemalloc reports to <csv_directory>/profiles")
+    parser.add_argument('--daemon', nargs='?', const='', metavar='SOCKET', help=f"hand the batch to a running extraction daemon (default: daemon_socket from config.json, else {DEFAULT_SOCKET})")
+    return parser.parse_args()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
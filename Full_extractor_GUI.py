@@ -1,19 +1,25 @@
 import os
 import base64
-import csv
 import json
 import logging
-import time
-import tkinter as tk
 from datetime import datetime
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from tkinter import messagebox, ttk
+from date_utils import internal_timestamp
+from extractor_daemon import job_request, run_or_submit
+from gmail_api import build_query, profile_for_fields
+from gmail_client import build, get_credentials, preload
+from jobs import ACTIONS, SenderExport
+from metrics import recorded
+from profiling import profile_directory, profile_phase, profiled
+from progress import ProgressBus, queue_emitter
 from threading import Thread
 from queue import Queue
+try:
+    import tkinter as tk
+    from tkinter import messagebox, ttk
+except ImportError:
+    # Python builds without Tk (headless servers) still run the worker
+    # functions, e.g. as extraction daemon jobs
+    tk = messagebox = ttk = None
 
 # Scopes for Gmail API
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
@@ -25,11 +31,23 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Columns written to the CSV
+CSV_FIELDS = ['id', 'date', 'from', 'subject', 'body']
+
 def load_config():
     default_config = {
         'csv_directory': './emails',
         'max_retries': 3,
-        'default_action': 'export'
+        'default_action': 'export',
+        'fetch_workers': 4,
+        'decode_processes': 0,
+        'engine': 'threads',
+        'bulk_actions': True,
+        'incremental': False,
+        'csv_include_body': True,
+        'metrics_report': '',
+        'prometheus_textfile': '',
+        'daemon_socket': ''
     }
     if os.path.exists('config.json'):
         with open('config.json', 'r') as f:
@@ -39,40 +57,7 @@ def load_config():
     return default_config
 
 def authenticate_gmail():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return creds
-
-def get_emails(service, sender_email, start_date=None, end_date=None, max_retries=3):
-    query = f'from:{sender_email}'
-    if start_date:
-        query += f' after:{start_date.strftime("%Y/%m/%d")}'
-    if end_date:
-        query += f' before:{end_date.strftime("%Y/%m/%d")}'
-    
-    for attempt in range(max_retries):
-        try:
-            results = service.users().messages().list(userId='me', q=query).execute()
-            return results.get('messages', [])
-        except HttpError as error:
-            if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                logging.warning(f"API error {error.resp.status}, retrying in {2 ** attempt}s")
-                time.sleep(2 ** attempt)
-                continue
-            logging.error(f"Failed to fetch emails: {error}")
-            return []
-        except Exception as e:
-            logging.error(f"Unexpected error fetching emails: {e}")
-            return []
+    return get_credentials(SCOPES)
 
 def get_message_body(payload):
     body = ''
@@ -84,147 +69,86 @@ def get_message_body(payload):
                     body += base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
                 elif 'parts' in part:
                     body += get_message_body(part)
-        elif 'data' in payload['body']:
+        elif 'data' in payload.get('body', {}):
             data = payload['body']['data']
             body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
     except Exception as e:
         logging.warning(f"Error decoding message body: {e}")
     return body
 
-def get_email_details(service, msg_id):
-    try:
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        headers = message['payload']['headers']
-        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
-        from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
-        date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
-        body = get_message_body(message['payload'])
-        
-        return {
-            'id': msg_id,
-            'date': date,
-            'from': from_email,
-            'subject': subject,
-            'body': body
-        }
-    except Exception as e:
-        logging.error(f"Error getting email details for {msg_id}: {e}")
-        return None
-
-def export_to_csv(emails, filename, progress_queue):
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    file_exists = os.path.isfile(filename)
-    
-    with open(filename, 'a' if file_exists else 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['id', 'date', 'from', 'subject', 'body']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        total = len(emails)
-        for i, email in enumerate(emails, 1):
-            if email:
-                writer.writerow(email)
-                progress_queue.put(('progress', i / total * 100, f"Exporting {i}/{total} emails"))
-        progress_queue.put(('progress', 100, "Export complete"))
-
-def read_existing_ids(filename):
-    if not os.path.isfile(filename):
-        return set()
+def parse_email(message):
+    headers = message['payload']['headers']
+    subject = next((header['value'] for header in headers if header['name'] == 'Subject'), '')
+    from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
+    date = next((header['value'] for header in headers if header['name'] == 'Date'), '')
+    body = get_message_body(message['payload'])
     
-    existing_ids = set()
-    try:
-        with open(filename, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                existing_ids.add(row['id'])
-    except Exception as e:
-        logging.error(f"Error reading existing CSV: {e}")
-    return existing_ids
-
-def delete_or_archive_emails(service, messages, action='delete', max_retries=3, progress_queue=None):
-    total = len(messages)
-    for i, msg in enumerate(messages, 1):
-        for attempt in range(max_retries):
-            try:
-                if action.lower() == 'delete':
-                    service.users().messages().trash(userId='me', id=msg['id']).execute()
-                elif action.lower() == 'archive':
-                    service.users().messages().modify(
-                        userId='me',
-                        id=msg['id'],
-                        body={'removeLabelIds': ['INBOX']}
-                    ).execute()
-                if progress_queue:
-                    progress_queue.put(('progress', i / total * 100, f"{action.capitalize()}ing {i}/{total} emails"))
-                break
-            except HttpError as error:
-                if error.resp.status in [429, 503] and attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-                logging.error(f"Failed to {action} email {msg['id']}: {error}")
-                break
-            except Exception as e:
-                logging.error(f"Unexpected error in {action} for {msg['id']}: {e}")
-                break
-    if progress_queue:
-        progress_queue.put(('progress', 100, f"{action.capitalize()} complete"))
+    return {
+        'id': message['id'],
+        'date': date,
+        'timestamp': internal_timestamp(message),
+        'from': from_email,
+        'subject': subject,
+        'body': body
+    }
 
-def process_emails_thread(sender_email, start_date, end_date, choice, csv_filename, progress_queue):
+def process_emails_thread(sender_email, start_date, end_date, choice, csv_filename, progress_queue, config=None):
+    config = config or {}
     # Authenticate
     progress_queue.put(('status', 0, "Authenticating..."))
+    # Per-message counters are coalesced into a few queue items a second
+    bus = ProgressBus(queue_emitter(progress_queue))
     logging.info(f"Starting email processing for {sender_email}")
     creds = authenticate_gmail()
     service = build('gmail', 'v1', credentials=creds)
     
     # Get emails
     progress_queue.put(('status', 10, "Fetching emails..."))
-    messages = get_emails(service, sender_email, start_date, end_date)
+    # Process emails page by page as they are listed
+    export = SenderExport(creds, service, sender_email, build_query(sender_email, start_date, end_date), csv_filename, CSV_FIELDS, config, dated=bool(start_date or end_date))
+    if export.journal.resumed:
+        progress_queue.put(('status', 10, f"Resuming after {len(export.journal.listed)} listed messages..."))
+    
+    # Request only what the CSV export writes
+    fields = CSV_FIELDS if config.get('csv_include_body', True) else [field for field in CSV_FIELDS if field != 'body']
+    # Each record is written to the store and appended to the CSV as soon as
+    # it is fetched, so memory stays flat and a crash keeps what was written
+    profile_phase('fetch')
+    messages = export.fetch(parse_email, profile_for_fields(fields), lambda stage, done, total: bus.update(stage, done, total, 10, 50))
+    
     if not messages:
         progress_queue.put(('complete', 0, f"No emails found from {sender_email}", "info"))
         logging.info(f"No emails found from {sender_email}")
+        export.finish()
         return
     
-    # Process emails
-    existing_ids = read_existing_ids(csv_filename)
-    new_emails = []
-    total_messages = len(messages)
-    
-    for i, msg in enumerate(messages, 1):
-        if msg['id'] not in existing_ids:
-            email_details = get_email_details(service, msg['id'])
-            if email_details:
-                new_emails.append(email_details)
-        progress_queue.put(('progress', (i / total_messages) * 50 + 10, f"Processing {i}/{total_messages} messages"))
-    
-    if new_emails:
-        export_to_csv(new_emails, csv_filename, progress_queue)
-        progress_queue.put(('complete', 100, f"Exported {len(new_emails)} new emails to {csv_filename}", "success"))
-        logging.info(f"Exported {len(new_emails)} new emails to {csv_filename}")
+    if export.new_ids:
+        progress_queue.put(('progress', 100, "Export complete"))
+        progress_queue.put(('complete', 100, f"Exported {len(export.new_ids)} new emails to {csv_filename}", "success"))
+        logging.info(f"Exported {len(export.new_ids)} new emails to {csv_filename}")
     else:
         progress_queue.put(('complete', 100, "No new emails found", "info"))
         logging.info("No new emails found")
     
     # Handle delete/archive
-    if choice == '2':
-        delete_or_archive_emails(service, messages, 'delete', progress_queue=progress_queue)
-        progress_queue.put(('complete', 100, "Emails deleted", "success"))
-        logging.info("Emails deleted")
-    elif choice == '3':
-        delete_or_archive_emails(service, messages, 'archive', progress_queue=progress_queue)
-        progress_queue.put(('complete', 100, "Emails archived", "success"))
-        logging.info("Emails archived")
+    profile_phase('action')
+    action = ACTIONS.get(choice)
+    export.finish(action, bus.update)
+    if action:
+        progress_queue.put(('complete', 100, f"Emails {action}d", "success"))
+        logging.info(f"Emails {action}d")
 
 class GmailBotGUI:
-    def __init__(self, root):
+    def __init__(self, root, profile=False):
         self.root = root
         self.root.title("Gmail Bot")
         self.config = load_config()
         self.progress_queue = Queue()
+        self.profile = profile
         
         # GUI Components
         self.create_widgets()
+        self.root.bind('<Control-Shift-P>', self.toggle_profiling)
         self.check_queue()
         
     def create_widgets(self):
@@ -261,24 +185,36 @@ class GmailBotGUI:
         self.status_label = tk.Label(self.root, text="Ready")
         self.status_label.grid(row=8, column=0, columnspan=2, pady=5)
         
+    def toggle_profiling(self, event=None):
+        # Hidden switch (Ctrl+Shift+P): profile the next runs
+        self.profile = not self.profile
+        self.status_label.config(text=f"Profiling {'on' if self.profile else 'off'}")
+    
+    def profile_directory(self):
+        return profile_directory(self.config['csv_directory'], 'Full_extractor_GUI') if self.profile else None
+    
     def update_progress(self, value, message):
         self.progress_bar['value'] = value
         self.status_label.config(text=message)
         self.root.update_idletasks()
 
     def check_queue(self):
+        # Drain everything queued since the last tick but redraw only the
+        # latest progress or status
+        latest = None
         while not self.progress_queue.empty():
             msg_type, value, message, *args = self.progress_queue.get()
-            if msg_type == 'progress':
-                self.update_progress(value, message)
+            if msg_type in ('progress', 'status'):
+                latest = (value, message)
             elif msg_type == 'complete':
+                latest = None
                 self.update_progress(value, "Process complete")
                 if args[0] == "success":
                     messagebox.showinfo("Success", message)
                 elif args[0] == "info":
                     messagebox.showinfo("Info", message)
-            elif msg_type == 'status':
-                self.update_progress(value, message)
+        if latest:
+            self.update_progress(*latest)
         self.root.after(100, self.check_queue)
 
     def start_processing(self):
@@ -301,15 +237,22 @@ class GmailBotGUI:
         csv_filename = os.path.join(self.config['csv_directory'], f"emails_from_{sender_email.split('@')[0]}.csv")
         
         self.process_button.config(state='disabled')
-        thread = Thread(target=process_emails_thread, args=(sender_email, start_date, end_date, choice, csv_filename, self.progress_queue))
+        run = recorded(profiled(process_emails_thread, self.profile_directory()), self.config.get('metrics_report'), self.config.get('prometheus_textfile'), script='Full_extractor_GUI')
+        # With daemon_socket set a running daemon takes the job; otherwise it runs here
+        request = job_request('gui', [sender_email], start_date, end_date, choice, self.profile)
+        thread = Thread(target=run_or_submit, args=(self.config.get('daemon_socket'), request, self.progress_queue, run, (sender_email, start_date, end_date, choice, csv_filename, self.progress_queue, self.config)))
         thread.start()
 
     def process_complete(self):
         self.process_button.config(state='normal')
 
 def main():
+    if tk is None:
+        raise SystemExit("The GUI needs tkinter (python3-tk); use the extraction daemon or Full_extractor on this host")
     root = tk.Tk()
     app = GmailBotGUI(root)
+    # The window is up first; the Google client loads behind it
+    root.after_idle(preload)
     root.mainloop()
 
 if __name__ == '__main__':
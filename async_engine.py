@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from gmail_api import MAX_BATCH_SIZE, batch_get_messages, iter_message_pages, open_decode_pool, submit_decode
+from gmail_client import build, service_pool
+from metrics import metrics
+from rate_limiter import execute_request
+
+# The Google client library only offers blocking calls, so each coroutine
+# hands its request to a small pool of threads (one Gmail client per thread).
+# Detail fetches go out as HTTP batches, which keeps hundreds of messages.get
+# calls in flight with only `concurrency` OS threads.
+
+class AsyncExtractor:
+    def __init__(self, creds, parse_message, concurrency=8, batch_size=MAX_BATCH_SIZE, max_retries=3, profile='full', decode_processes=0):
+        self.creds = creds
+        self.parse_message = parse_message
+        self.concurrency = max(1, concurrency)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.profile = profile
+        self.decode_processes = decode_processes
+        self.decoder = None
+        self._local = threading.local()
+        self._services = []
+        self.executor = None
+        self.semaphore = None
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = service_pool.take(self.creds) or build('gmail', 'v1', credentials=self.creds)
+            self._local.service = service
+            self._services.append(service)
+        return service
+
+    async def _run(self, func, *args):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def iter_pages(self, query, pages=None):
+        # messages.list pages depend on the previous nextPageToken, so the
+        # listing itself is sequential; detail fetches overlap with it.
+        if pages is None:
+            pages = iter_message_pages(self._listing_service, query)
+        loop = asyncio.get_running_loop()
+        while True:
+            page = await loop.run_in_executor(self.executor, next, pages, None)
+            if page is None:
+                return
+            yield page
+
+    def _fetch_chunk(self, msg_ids):
+        return batch_get_messages(self._service(), msg_ids, None if self.decoder else self.parse_message,
+                                  self.batch_size, self.max_retries, self.profile)
+
+    async def fetch(self, msg_ids):
+        records = await self._run(self._fetch_chunk, msg_ids)
+        if self.decoder:
+            # Decoding runs in the process pool, outside the semaphore, so
+            # the I/O threads move on to the next chunk meanwhile
+            records = await asyncio.wrap_future(submit_decode(self.decoder, self.parse_message, records))
+        return records
+
+    def _apply_action(self, msg_id, action):
+        try:
+            with metrics.stage('action', 1):
+                if action.lower() == 'delete':
+                    execute_request(self._service().users().messages().trash(userId='me', id=msg_id),
+                                    'trash', self.max_retries)
+                elif action.lower() == 'archive':
+                    execute_request(self._service().users().messages().modify(
+                        userId='me',
+                        id=msg_id,
+                        body={'removeLabelIds': ['INBOX']}
+                    ), 'modify', self.max_retries)
+            return True
+        except HttpError as error:
+            logging.error(f"Failed to {action} email {msg_id}: {error}")
+        except Exception as e:
+            logging.error(f"Unexpected error in {action} for {msg_id}: {e}")
+        return False
+
+    async def apply_action(self, messages, action, progress=None):
+        done = 0
+        total = len(messages)
+
+        async def run_one(msg):
+            nonlocal done
+            ok = await self._run(self._apply_action, msg['id'], action)
+            done += 1
+            if progress:
+                progress(done, total)
+            return ok
+
+        results = await asyncio.gather(*(run_one(msg) for msg in messages))
+        return sum(1 for ok in results if ok)
+
+    async def extract(self, query, existing_ids, progress=None, pages=None, on_record=None):
+        messages = []
+        records = []
+        tasks = deque()
+        # Listing runs ahead of the fetches, so progress counts the listed
+        # messages that are already exported or whose chunk has come back
+        done = 0
+        total = 0
+
+        def emit(size, chunk):
+            nonlocal done
+            for record in chunk:
+                if on_record:
+                    on_record(record)
+                else:
+                    records.append(record)
+            done += size
+            if progress:
+                progress(done, total)
+
+        async for page in self.iter_pages(query, pages):
+            page_messages = page.get('messages', [])
+            messages.extend(page_messages)
+            new_ids = [msg['id'] for msg in page_messages if msg['id'] not in existing_ids]
+            for start in range(0, len(new_ids), self.batch_size):
+                chunk = new_ids[start:start + self.batch_size]
+                tasks.append((len(chunk), asyncio.create_task(self.fetch(chunk))))
+            done += len(page_messages) - len(new_ids)
+            total = max(page.get('resultSizeEstimate', 0), len(messages))
+            if progress:
+                progress(done, total)
+            # Hand back finished chunks in listing order while listing continues
+            while tasks and tasks[0][1].done():
+                size, task = tasks.popleft()
+                emit(size, task.result())
+        total = len(messages)
+        while tasks:
+            size, task = tasks.popleft()
+            emit(size, await task)
+        return messages, records
+
+    async def _session(self, coro_func, *args, **kwargs):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        # One extra thread so the sequential listing never waits behind fetches
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency + 1, thread_name_prefix='gmail-async')
+        self.decoder = open_decode_pool(self.decode_processes)
+        try:
+            self._listing_service = service_pool.take(self.creds) or build('gmail', 'v1', credentials=self.creds)
+            self._services.append(self._listing_service)
+            return await coro_func(*args, **kwargs)
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.decoder:
+                self.decoder.shutdown(wait=True)
+                self.decoder = None
+            # The next session runs on new threads; its clients come back
+            # out of the pool
+            service_pool.give_back(self.creds, self._services)
+            self._services = []
+
+    def run_extract(self, query, existing_ids, progress=None, pages=None, on_record=None):
+        return asyncio.run(self._session(self.extract, query, existing_ids, progress, pages, on_record))
+
+    def run_action(self, messages, action, progress=None):
+        return asyncio.run(self._session(self.apply_action, messages, action, progress))
@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from gmail_client import build, service_pool
+from metrics import metrics
+from rate_limiter import execute_request
+
+SPOOL_DIRNAME = 'attachments'
+
+# base64 text is decoded this many characters at a time. A multiple of 4,
+# so every slice except the last decodes on its own.
+DECODE_CHUNK_CHARS = 64 * 1024
+
+def iter_decoded(data, chunk_chars=DECODE_CHUNK_CHARS):
+    for start in range(0, len(data), chunk_chars):
+        chunk = data[start:start + chunk_chars]
+        # Gmail may leave the padding off the final slice
+        chunk += '=' * (-len(chunk) % 4)
+        yield base64.urlsafe_b64decode(chunk)
+
+def link_blob(blob_path, target):
+    # Hard links share the blob's disk blocks; filesystems without them
+    # (or a blob store on another volume) get a copy instead
+    if os.path.exists(target):
+        if os.path.samefile(blob_path, target):
+            return
+        os.remove(target)
+    try:
+        os.link(blob_path, target)
+    except OSError:
+        shutil.copyfile(blob_path, target)
+
+class AttachmentSpooler:
+    # Writes attachments into a content-addressed blob store while the
+    # message is parsed, so records carry a path, size and SHA-256 instead
+    # of the decoded bytes, and a file sent a thousand times is stored once.
+    # Parts that Gmail only exposes by attachmentId are downloaded with
+    # attachments.get. Parsing runs on the fetch worker threads, so each
+    # thread takes its own Gmail client from the pool, as in MessageFetcher,
+    # and close() returns them once the fetch is over.
+    def __init__(self, creds, directory, max_retries=3):
+        self.creds = creds
+        self.directory = directory
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self._services = []
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        service_pool.give_back(self.creds, self._services)
+        self._services = []
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = service_pool.take(self.creds) or build('gmail', 'v1', credentials=self.creds)
+            self._local.service = service
+            self._services.append(service)
+        return service
+
+    def _attachment_data(self, msg_id, body):
+        if 'data' in body:
+            return body['data']
+        if 'attachmentId' in body:
+            response = execute_request(self._service().users().messages().attachments().get(
+                userId='me', messageId=msg_id, id=body['attachmentId']
+            ), 'attachments.get', self.max_retries)
+            metrics.inc('bytes_downloaded_total', len(response.get('data', '')), kind='attachment')
+            return response.get('data', '')
+        return ''
+
+    def blob_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def _write_blob(self, data, blob_path):
+        # Written under a temp name and renamed, so a crash never leaves a
+        # truncated file at a hash path
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # Created like a plain open() so the umask applies; exports are hard
+        # links to the same inode
+        tmp_path = os.path.join(self.directory, f'{uuid.uuid4().hex}.tmp')
+        fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter_decoded(data):
+                    f.write(chunk)
+                size = f.tell()
+            os.replace(tmp_path, blob_path)
+            metrics.inc('bytes_written_total', size, output='attachments')
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def spool(self, msg_id, part):
+        body = part.get('body', {})
+        attachment = {'filename': part['filename'], 'mimeType': part['mimeType'], 'size': body.get('size', 0)}
+        try:
+            with metrics.stage('attachments', 1):
+                data = self._attachment_data(msg_id, body)
+                # Hash first so content already in the store is never written again
+                digest = hashlib.sha256()
+                size = 0
+                for chunk in iter_decoded(data):
+                    digest.update(chunk)
+                    size += len(chunk)
+                sha256 = digest.hexdigest()
+                blob_path = self.blob_path(sha256)
+                if not os.path.exists(blob_path):
+                    self._write_blob(data, blob_path)
+        except Exception as e:
+            logging.error(f"Failed to save attachment {part['filename']} of {msg_id}: {e}")
+            return attachment
+        attachment.update(size=size, sha256=sha256, path=blob_path)
+        return attachment
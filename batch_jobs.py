@@ -0,0 +1,74 @@
+import logging
+from gmail_api import iter_message_pages
+
+# Gmail has no documented query length limit, but very long queries are
+# rejected, so senders are combined into OR queries of at most this many
+MAX_SENDERS_PER_QUERY = 20
+
+def read_senders_file(filename):
+    # One sender per line; blank lines and lines starting with # are skipped
+    senders = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                senders.append(line)
+    return senders
+
+def unique_senders(senders):
+    seen = set()
+    result = []
+    for sender in senders:
+        if sender.lower() not in seen:
+            seen.add(sender.lower())
+            result.append(sender)
+    return result
+
+def build_sender_queries(senders, start_date=None, end_date=None, max_senders=MAX_SENDERS_PER_QUERY):
+    # Same filters as build_query, with from:(a OR b OR ...) per group
+    date_filter = ''
+    if start_date:
+        date_filter += f' after:{start_date.strftime("%Y/%m/%d")}'
+    if end_date:
+        date_filter += f' before:{end_date.strftime("%Y/%m/%d")}'
+    queries = []
+    for start in range(0, len(senders), max_senders):
+        group = [f'"{sender}"' if ' ' in sender else sender for sender in senders[start:start + max_senders]]
+        queries.append(f'from:({" OR ".join(group)}){date_filter}')
+    return queries
+
+def iter_batch_pages(service, queries, max_retries=3, page_token=None):
+    # Chains the listings of every query into one page stream for the shared
+    # fetch stage, dropping ids an earlier query already returned. Page
+    # tokens are '<query index>:<messages.list token>' so a batch can resume.
+    seen = set()
+    first, _, query_token = page_token.partition(':') if page_token else ('0', '', '')
+    for index in range(int(first), len(queries)):
+        pages = iter_message_pages(service, queries[index], max_retries=max_retries, page_token=query_token or None)
+        query_token = None
+        finished = False
+        for page in pages:
+            finished = not page.get('nextPageToken')
+            messages = [msg for msg in page.get('messages', []) if msg['id'] not in seen]
+            seen.update(msg['id'] for msg in messages)
+            page = dict(page, messages=messages)
+            if page.get('nextPageToken'):
+                page['nextPageToken'] = f"{index}:{page['nextPageToken']}"
+            elif index + 1 < len(queries):
+                page['nextPageToken'] = f"{index + 1}:"
+            yield page
+        if not finished:
+            # The listing failed; ending on a page that still has a next
+            # token keeps the run from counting as complete
+            logging.error(f"Stopping the batch listing at query {index + 1} of {len(queries)}")
+            return
+
+def match_sender(from_header, senders):
+    # Routes a fetched message back to the sender it was listed for. The
+    # longest match wins, so orders@shop.com beats shop.com.
+    from_header = (from_header or '').lower()
+    matches = [sender for sender in senders if sender.lower() in from_header]
+    if not matches:
+        logging.warning(f"No batch sender matches From header {from_header!r}")
+        return None
+    return max(matches, key=len)
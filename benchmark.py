@@ -0,0 +1,176 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from queue import Queue
+from fake_gmail import FakeLatency, SyntheticMailbox, fake_build
+from metrics import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Offline benchmark: runs the real extraction paths (listing, batched
+# messages.get, decoding, the store and the exporters) against a synthetic
+# mailbox served by fake_gmail, and reports messages/s, peak RSS and the
+# per-stage times recorded in metrics.
+
+# Modules that bind googleapiclient's build at import time
+BUILD_MODULES = ['gmail_api', 'async_engine', 'attachments']
+
+SCRIPTS = {
+    'cli': 'Full_extractor',
+    'gui': 'Full_extractor_GUI',
+    'simple': 'Advanced_Email_extractor',
+    'full': 'Advanced_Email_extractor',
+}
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+def install_fake_gmail(script, build):
+    import rate_limiter
+    for name in BUILD_MODULES + [script.__name__]:
+        __import__(name)
+        sys.modules[name].build = build
+    # The scripts never reach the OAuth flow
+    script.authenticate_gmail = lambda: None
+    return rate_limiter
+
+def run_scenario(args, script, senders, config):
+    progress_queue = Queue()
+    if args.scenario == 'cli':
+        script.process_batch(senders, None, None, args.choice, config)
+    elif args.scenario == 'gui':
+        csv_filename = os.path.join(config['csv_directory'], f"emails_from_{senders[0].split('@')[0]}.csv")
+        script.process_emails_thread(senders[0], None, None, args.choice, csv_filename, progress_queue, config)
+    else:
+        script.process_emails_thread(senders[0], None, None, args.choice, args.scenario, config, progress_queue)
+    messages = []
+    while not progress_queue.empty():
+        item = progress_queue.get()
+        if item[0] == 'complete':
+            messages.append(item[2])
+    return messages
+
+def main():
+    args = parse_args()
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='gmail-bench-'))
+    os.makedirs(workdir, exist_ok=True)
+    # The scripts log to and read config from the working directory
+    os.chdir(workdir)
+
+    senders = [f'sender{n}@example.com' for n in range(args.senders)]
+    if args.scenario != 'cli':
+        senders = senders[:1]
+    mailbox = SyntheticMailbox(args.messages, senders, args.seed, args.body_bytes, args.attachment_ratio,
+                               args.attachment_bytes, args.distinct_attachments)
+    latency = FakeLatency(args.latency, args.per_item_latency, rate_limit_ratio=args.rate_limit_ratio, seed=args.seed)
+    build = fake_build(mailbox, latency)
+
+    script = __import__(SCRIPTS[args.scenario])
+    rate_limiter = install_fake_gmail(script, build)
+    if args.units_per_second:
+        rate_limiter.limiter.rate = rate_limiter.limiter.capacity = args.units_per_second
+    else:
+        # Only the fake latency limits throughput
+        rate_limiter.limiter.rate = rate_limiter.limiter.capacity = rate_limiter.limiter.tokens = 1e12
+
+    config = {
+        'csv_directory': os.path.join(workdir, 'emails'),
+        'max_retries': 3,
+        'fetch_workers': args.workers,
+        'decode_processes': args.decode_processes,
+        'engine': args.engine,
+        'bulk_actions': not args.per_message_actions,
+        'incremental': False,
+        'csv_include_body': not args.no_body,
+        'jsonl_gzip': args.jsonl_gzip,
+        'parquet': args.parquet
+    }
+
+    print(f"Benchmarking '{args.scenario}' on {args.messages} synthetic messages from {len(senders)} sender(s) in {workdir}")
+    metrics.reset()
+    started = time.monotonic()
+    messages = run_scenario(args, script, senders, config)
+    elapsed = time.monotonic() - started
+
+    report = metrics.report()
+    fetched = report['counters'].get('stage_items_total', {}).get('stage=fetch', 0)
+    own_rss, children_rss = peak_rss_mb()
+    calls = {}
+    for service in build.services:
+        for name, count in service.calls.items():
+            calls[name] = calls.get(name, 0) + count
+    info = {
+        'scenario': args.scenario,
+        'engine': args.engine,
+        'workers': args.workers,
+        'decode_processes': args.decode_processes,
+        'messages': args.messages,
+        'senders': len(senders),
+        'fetched': fetched,
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_per_second': round(fetched / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': own_rss,
+        'peak_children_rss_mb': children_rss,
+        'fake_latency': {'request': args.latency, 'per_item': args.per_item_latency, 'rate_limit_ratio': args.rate_limit_ratio},
+        'fake_calls': calls,
+    }
+
+    for message in messages:
+        print(message)
+    print(f"Fetched {fetched} messages in {elapsed:.2f}s ({info['messages_per_second']} msgs/s)")
+    if own_rss is not None:
+        print(f"Peak RSS {own_rss} MB (decode processes {children_rss} MB)")
+    print(f"API calls: {', '.join(f'{name} {count}' for name, count in sorted(calls.items()))}")
+    print(f"{'stage':<16}{'busy s':>10}{'items':>10}{'items/busy s':>14}")
+    for stage, times in sorted(report['stages'].items()):
+        print(f"{stage:<16}{times['busy_seconds']:>10.2f}{times['items']:>10}{times['items_per_busy_second'] or 0:>14.1f}")
+
+    if args.report:
+        print(f"Report written to {metrics.write_report(os.path.join(args.output_dir, args.report), benchmark=info)}")
+    if not args.keep and not args.workdir:
+        os.chdir(args.output_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the extractors against a synthetic Gmail mailbox, without network access.")
+    parser.add_argument('--scenario', choices=sorted(SCRIPTS), default='cli', help="cli: Full_extractor batch export, gui: Full_extractor_GUI, simple/full: Advanced_Email_extractor modes")
+    parser.add_argument('--messages', type=int, default=10000, help="mailbox size")
+    parser.add_argument('--senders', type=int, default=1, help="senders in the mailbox (cli scenario exports all of them)")
+    parser.add_argument('--body-bytes', type=int, default=4000, help="average text body size")
+    parser.add_argument('--attachment-ratio', type=float, default=0.2, help="share of messages with attachments")
+    parser.add_argument('--attachment-bytes', type=int, default=100000, help="average attachment size")
+    parser.add_argument('--distinct-attachments', type=int, default=50, help="distinct attachment payloads in the mailbox")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per HTTP request")
+    parser.add_argument('--per-item-latency', type=float, default=0.002, help="extra seconds per call inside a batch")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument('--units-per-second', type=float, default=0, help="client-side quota limit (0 disables it)")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--decode-processes', type=int, default=0)
+    parser.add_argument('--choice', choices=['1', '2', '3'], default='1', help="1 export, 2 export and delete, 3 export and archive")
+    parser.add_argument('--per-message-actions', action='store_true', help="delete/archive one message at a time instead of in bulk")
+    parser.add_argument('--no-body', action='store_true', help="leave bodies out of the CSV (lighter fetch profile)")
+    parser.add_argument('--jsonl-gzip', action='store_true')
+    parser.add_argument('--parquet', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help="where the exports are written (default: a temporary directory that is removed)")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary directory")
+    parser.add_argument('--report', help="write a JSON report with the benchmark settings and all metrics ({timestamp} is replaced)")
+    args = parser.parse_args()
+    args.output_dir = os.getcwd()
+    return args
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+# Mail from one sender repeats the same few Date header shapes, and a bulk
+# sender often stamps thousands of messages with the same second, so parsed
+# headers and formatted days are cached.
+CACHE_SIZE = 65536
+
+@lru_cache(maxsize=CACHE_SIZE)
+def header_timestamp(date_header):
+    # UTC seconds for an RFC 2822 Date header, or None if it cannot be parsed
+    if not date_header:
+        return None
+    try:
+        date = parsedate_to_datetime(date_header)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        # RFC 2822 "-0000" means UTC with no source zone
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+def internal_timestamp(message):
+    # Gmail's internalDate (milliseconds) is when the message was received
+    # and is always present, unlike a well-formed Date header
+    internal_date = message.get('internalDate')
+    return int(internal_date) // 1000 if internal_date else None
+
+def message_timestamp(record):
+    timestamp = record.get('timestamp')
+    if timestamp is None:
+        timestamp = header_timestamp(record.get('date', ''))
+    return timestamp
+
+# Every UTC offset in use is a whole number of quarter hours, so all
+# timestamps in one quarter hour fall on the same local day
+QUARTER_HOUR = 900
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _day_key(quarter):
+    return datetime.fromtimestamp(quarter * QUARTER_HOUR).strftime('%Y-%m-%d')
+
+def day_key(timestamp):
+    # 'YYYY-MM-DD' of the local day, the same days the store's date range
+    # filters use; undated messages go to the epoch
+    return _day_key(timestamp // QUARTER_HOUR if timestamp is not None else 0)
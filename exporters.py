@@ -0,0 +1,377 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from date_utils import message_timestamp
+from metrics import metrics
+
+# Parquet export is optional and only offered when pyarrow is installed.
+# pyarrow takes longer to import than the rest of the program, so it is
+# loaded when the first Parquet file is opened.
+pa = pq = None
+
+def load_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+class CsvStreamWriter:
+    # Appends each record to the CSV as soon as it is fetched so memory stays
+    # flat and a crash keeps every row written so far. The file is opened on
+    # the first record, so runs with nothing new leave no empty file behind.
+    def __init__(self, filename, fieldnames, preamble=None, flush_every=100, fsync_interval=5.0):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.preamble = preamble
+        self.flush_every = flush_every
+        self.fsync_interval = fsync_interval
+        self.csvfile = None
+        self.writer = None
+        self.count = 0
+        self.start_offset = 0
+        self.last_sync = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        file_exists = os.path.isfile(self.filename)
+        self.csvfile = open(self.filename, 'a' if file_exists else 'w', newline='', encoding='utf-8')
+        self.start_offset = self.csvfile.tell()
+        self.writer = csv.DictWriter(self.csvfile, fieldnames=self.fieldnames, extrasaction='ignore')
+        if not file_exists:
+            if self.preamble:
+                # Callable so the caller can fill in counts known only once
+                # the first record arrives
+                row = self.preamble() if callable(self.preamble) else self.preamble
+                csv.writer(self.csvfile).writerow(row)
+            self.writer.writeheader()
+
+    def write(self, record):
+        if self.writer is None:
+            self._open()
+        self.writer.writerow(record)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush(sync=time.monotonic() - self.last_sync >= self.fsync_interval)
+
+    def flush(self, sync=False):
+        if self.csvfile is None:
+            return
+        self.csvfile.flush()
+        if sync:
+            os.fsync(self.csvfile.fileno())
+            self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.csvfile is None:
+            return
+        self.flush(sync=True)
+        metrics.inc('bytes_written_total', self.csvfile.tell() - self.start_offset, output='csv')
+        self.csvfile.close()
+        self.csvfile = None
+        self.writer = None
+
+# The calendar report keeps one shard per month next to a small index page
+SHARD_DIRNAME = 'shards'
+SHARD_BUFFER_BYTES = 4 * 1024 * 1024
+
+def render_email_html(email):
+    return (
+        '<div class="email-container">' +
+        f'<h3>{email["subject"]}</h3>' +
+        f'<p>{email["html_body"] or email["body"]}</p>' +
+        ''.join(f'<p>Attachment: <a href="{a["path"]}" download>{a["filename"]}</a></p>' for a in email["attachments"]) +
+        '</div>'
+    )
+
+class CalendarShards:
+    # Renders each email as it is seen and buffers it per month, spilling
+    # the buffers to <month>.jsonl once they pass buffer_bytes. finish()
+    # turns every month into <month>.js, which the report pulls in with a
+    # script tag (fetch() is blocked for pages opened from disk).
+    def __init__(self, directory, buffer_bytes=SHARD_BUFFER_BYTES):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        self.directory = directory
+        self.buffer_bytes = buffer_bytes
+        self.buffers = {}
+        self.buffered = 0
+        self.days = {}
+
+    def add(self, date_key, email):
+        line = json.dumps({'day': date_key, 'timestamp': message_timestamp(email) or 0, 'html': render_email_html(email)}) + '\n'
+        self.buffers.setdefault(date_key[:7], []).append(line)
+        self.buffered += len(line)
+        self.days[date_key] = self.days.get(date_key, 0) + 1
+        if self.buffered >= self.buffer_bytes:
+            self.spill()
+
+    def spill(self):
+        for month, lines in self.buffers.items():
+            with open(os.path.join(self.directory, f'{month}.jsonl'), 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        self.buffers = {}
+        self.buffered = 0
+
+    def finish(self):
+        # Only one month is held in memory at a time
+        self.spill()
+        for month in sorted({day[:7] for day in self.days}):
+            jsonl_path = os.path.join(self.directory, f'{month}.jsonl')
+            by_day = {}
+            with open(jsonl_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    by_day.setdefault(entry['day'], []).append(entry)
+            with open(os.path.join(self.directory, f'{month}.js'), 'w', encoding='utf-8') as f:
+                f.write(f'loadShard({json.dumps(month)}, {{')
+                for n, day in enumerate(sorted(by_day)):
+                    entries = sorted(by_day[day], key=lambda x: x['timestamp'], reverse=True)
+                    f.write(('' if n == 0 else ',') + f'{json.dumps(day)}: ' + json.dumps([entry['html'] for entry in entries]))
+                f.write('});\n')
+                metrics.inc('bytes_written_total', f.tell(), output='calendar')
+            os.remove(jsonl_path)
+        return self.days
+
+def open_jsonl(filename, mode):
+    # .gz names are read and written through gzip transparently
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8', newline='\n')
+    return open(filename, mode, encoding='utf-8', newline='\n')
+
+class JsonlWriter:
+    # One JSON object per line, written as each record arrives, so neither
+    # the export nor its readers ever hold the whole corpus. Written to a temp
+    # name and renamed on close so readers never see a half-written file.
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp_filename = filename + '.tmp' + ('.gz' if filename.endswith('.gz') else '')
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.f = open_jsonl(self.tmp_filename, 'w')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # A failed export never replaces the last complete one
+        self.close(discard=exc_info[0] is not None)
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self, discard=False):
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        if discard:
+            os.remove(self.tmp_filename)
+            return
+        metrics.inc('bytes_written_total', os.path.getsize(self.tmp_filename), output='jsonl')
+        os.replace(self.tmp_filename, self.filename)
+
+class JsonlReader:
+    # Lazy reader for JsonlWriter output. Plain files get a byte-offset index
+    # on first random access, so reader[i] and iter_from(i) seek straight to
+    # the record; gzip streams cannot seek, so they skip lines unparsed.
+    def __init__(self, filename):
+        self.filename = filename
+        self.compressed = filename.endswith('.gz')
+        self.offsets = None
+
+    def _build_index(self):
+        offsets = []
+        with open(self.filename, 'rb') as f:
+            position = 0
+            for line in f:
+                offsets.append(position)
+                position += len(line)
+        self.offsets = offsets
+
+    def __len__(self):
+        if self.compressed:
+            with open_jsonl(self.filename, 'r') as f:
+                return sum(1 for _ in f)
+        if self.offsets is None:
+            self._build_index()
+        return len(self.offsets)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        if self.compressed:
+            with open_jsonl(self.filename, 'r') as f:
+                for n, line in enumerate(f):
+                    if n >= start:
+                        yield json.loads(line)
+            return
+        if start and self.offsets is None:
+            self._build_index()
+        with open(self.filename, 'rb') as f:
+            if start:
+                if start >= len(self.offsets):
+                    return
+                f.seek(self.offsets[start])
+            for line in f:
+                yield json.loads(line)
+
+    def __getitem__(self, index):
+        start = index
+        if start < 0:
+            # Counted from the end, like a list
+            start += len(self)
+            if start < 0:
+                raise IndexError(index)
+        for record in self.iter_from(start):
+            return record
+        raise IndexError(index)
+
+class CsvIdIndex:
+    # The ids already exported to each CSV, kept for the life of the process
+    # so back-to-back runs (daemon jobs, repeated GUI runs) do not re-read
+    # whole files. A file that only grew since the last read is read from
+    # where that read stopped; a new, truncated (resumed job) or rewritten
+    # file is read again in full.
+    def __init__(self, key='id'):
+        self.key = key
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def _unchanged_until(self, f, entry):
+        # The bytes around the old end must still be there for an append
+        f.seek(max(0, entry['size'] - len(entry['tail'])))
+        return f.read(len(entry['tail'])) == entry['tail']
+
+    def read(self, filename):
+        path = os.path.abspath(filename)
+        with self.lock:
+            if not os.path.isfile(path):
+                self.files.pop(path, None)
+                return set()
+            stat = os.stat(path)
+            entry = self.files.get(path)
+            with open(path, 'rb') as f:
+                if (entry is None or entry['inode'] != stat.st_ino or stat.st_size < entry['size']
+                        or (stat.st_size == entry['size'] and stat.st_mtime_ns != entry['mtime'])
+                        or not self._unchanged_until(f, entry)):
+                    entry = {'inode': stat.st_ino, 'size': 0, 'mtime': None, 'tail': b'', 'fieldnames': None, 'ids': set()}
+                if stat.st_size > entry['size']:
+                    f.seek(entry['size'])
+                    data = f.read()
+                    rows = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+                    if entry['fieldnames'] is None:
+                        # The header is the first row with the key column;
+                        # Advanced_Email_extractor writes a preamble row above it
+                        entry['fieldnames'] = next((row for row in rows if self.key in row), None)
+                        if entry['fieldnames'] is None:
+                            self.files.pop(path, None)
+                            return set()
+                    column = entry['fieldnames'].index(self.key)
+                    entry['ids'].update(row[column] for row in rows if len(row) > column)
+                    entry['size'] += len(data)
+                    entry['tail'] = (entry['tail'] + data)[-64:]
+            entry['mtime'] = stat.st_mtime_ns
+            # A row cut off by a writer that is still flushing is read again
+            # with the whole file next time
+            if entry['tail'].endswith(b'\n'):
+                self.files[path] = entry
+            else:
+                self.files.pop(path, None)
+            return set(entry['ids'])
+
+csv_ids = CsvIdIndex()
+
+PARQUET_ROW_GROUP_SIZE = 10000
+
+def parquet_schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('timestamp', pa.timestamp('s', tz='UTC')),
+        ('sender', pa.string()),
+        ('from', pa.string()),
+        ('subject', pa.string()),
+        ('body_length', pa.int32()),
+        ('attachment_count', pa.int32()),
+        ('body', pa.string()),
+        ('html_body', pa.string()),
+    ])
+
+class ParquetStreamWriter:
+    # Typed columnar copy of the export for pandas/duckdb. Rows are buffered
+    # and written as one row group per row_group_size records, so memory is
+    # bounded by a single group.
+    def __init__(self, filename, sender, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        if not load_pyarrow():
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.filename = filename
+        self.tmp_filename = filename + '.tmp'
+        self.sender = sender
+        self.row_group_size = row_group_size
+        self.schema = parquet_schema()
+        self.writer = pq.ParquetWriter(self.tmp_filename, self.schema, compression='zstd')
+        self.rows = {name: [] for name in self.schema.names}
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close(discard=exc_info[0] is not None)
+
+    def write(self, record):
+        body = record.get('body') or ''
+        timestamp = message_timestamp(record)
+        row = {
+            'id': record['id'],
+            'timestamp': timestamp,
+            'sender': self.sender,
+            'from': record.get('from', ''),
+            'subject': record.get('subject', ''),
+            'body_length': len(body),
+            'attachment_count': len(record.get('attachments') or []),
+            'body': body,
+            'html_body': record.get('html_body') or '',
+        }
+        for name, value in row.items():
+            self.rows[name].append(value)
+        self.count += 1
+        if len(self.rows['id']) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows['id']:
+            return
+        self.writer.write_table(pa.table(self.rows, schema=self.schema))
+        self.rows = {name: [] for name in self.schema.names}
+
+    def close(self, discard=False):
+        if self.writer is None:
+            return
+        if not discard:
+            self.flush()
+        self.writer.close()
+        self.writer = None
+        if discard:
+            os.remove(self.tmp_filename)
+            return
+        metrics.inc('bytes_written_total', os.path.getsize(self.tmp_filename), output='parquet')
+        os.replace(self.tmp_filename, self.filename)
@@ -0,0 +1,287 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from datetime import datetime
+from queue import Queue
+from gmail_client import discovery_document
+from metrics import recorded_run
+from profiling import profile_directory, profiled_run
+
+# Long-running extraction daemon. Everything a cold start pays for stays
+# warm between jobs: the imported client libraries and the discovery
+# document, the credentials (gmail_client), idle Gmail clients
+# (gmail_client.service_pool) and the ids already exported to each CSV
+# (exporters.csv_ids). Jobs arrive as one JSON line over a Unix domain
+# socket and run one at a time in arrival order, since they share the quota
+# limiter and the local store; their progress is streamed back as JSON lines.
+#
+# Request: {"job": "batch" | "gui" | "simple" | "full", "senders": [...],
+#           "start": "YYYY-MM-DD" | null, "end": ..., "choice": "1" | "2" | "3",
+#           "profile": false}
+# Events:  {"event": "queued", "position": n}
+#          {"event": "output", "text": ...}        printed by batch jobs
+#          {"event": "progress", "item": [...]}    GUI progress queue items
+#          {"event": "done", "ok": true | false, "error": ...}
+
+DEFAULT_SOCKET = 'extractor.sock'
+
+# Job kind -> script whose functions run it
+JOB_SCRIPTS = {
+    'batch': 'Full_extractor',
+    'gui': 'Full_extractor_GUI',
+    'simple': 'Advanced_Email_extractor',
+    'full': 'Advanced_Email_extractor',
+}
+
+def job_request(kind, senders, start_date=None, end_date=None, choice='1', profile=False):
+    return {
+        'job': kind,
+        'senders': list(senders),
+        'start': start_date.strftime('%Y-%m-%d') if start_date else None,
+        'end': end_date.strftime('%Y-%m-%d') if end_date else None,
+        'choice': choice,
+        'profile': profile,
+    }
+
+def parse_request(request):
+    # Checked before the job is queued so a bad request fails at once
+    kind = request.get('job')
+    if kind not in JOB_SCRIPTS:
+        raise ValueError(f"Unknown job {kind!r}; expected one of {', '.join(sorted(JOB_SCRIPTS))}")
+    senders = request.get('senders')
+    if not senders or not isinstance(senders, list) or not all(isinstance(sender, str) and sender for sender in senders):
+        raise ValueError("A job needs a list of sender addresses")
+    if kind != 'batch' and len(senders) != 1:
+        raise ValueError(f"A {kind} job takes exactly one sender")
+    choice = request.get('choice') or '1'
+    if choice not in ('1', '2', '3'):
+        raise ValueError(f"Unknown choice {choice!r}; expected 1, 2 or 3")
+    start_date = datetime.strptime(request['start'], '%Y-%m-%d') if request.get('start') else None
+    end_date = datetime.strptime(request['end'], '%Y-%m-%d') if request.get('end') else None
+    return kind, senders, start_date, end_date, choice, bool(request.get('profile'))
+
+class RelayQueue:
+    # Stands in for a GUI progress queue and forwards what the job posts
+    def __init__(self, send):
+        self.send = send
+
+    def put(self, item):
+        self.send({'event': 'progress', 'item': list(item)})
+
+class RelayOutput:
+    # Forwards what a batch job prints; progress lines end in '\r'
+    def __init__(self, send):
+        self.send = send
+
+    def write(self, text):
+        if text:
+            self.send({'event': 'output', 'text': text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+def run_job(job, send):
+    kind, senders, start_date, end_date, choice, profile = job
+    script = __import__(JOB_SCRIPTS[kind])
+    # Read per job so config.json edits apply without a restart
+    config = script.load_config()
+    profile_dir = profile_directory(config['csv_directory'], f'daemon-{kind}') if profile else None
+    with recorded_run(config.get('metrics_report'), config.get('prometheus_textfile'), script=script.__name__), profiled_run(profile_dir):
+        if kind == 'batch':
+            # Jobs run one at a time, so swapping stdout only catches this job
+            with contextlib.redirect_stdout(RelayOutput(send)):
+                script.process_batch(senders, start_date, end_date, choice, config)
+        elif kind == 'gui':
+            csv_filename = os.path.join(config['csv_directory'], f"emails_from_{senders[0].split('@')[0]}.csv")
+            script.process_emails_thread(senders[0], start_date, end_date, choice, csv_filename, RelayQueue(send), config)
+        else:
+            script.process_emails_thread(senders[0], start_date, end_date, choice, kind, config, RelayQueue(send))
+
+class JobRunner:
+    def __init__(self):
+        self.jobs = Queue()
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def submit(self, job, send):
+        with self.lock:
+            position = self.waiting
+            self.waiting += 1
+        self.jobs.put((job, send))
+        return position
+
+    def work(self):
+        while True:
+            job, send = self.jobs.get()
+            kind, senders = job[0], job[1]
+            logging.info(f"Daemon job started: {kind} for {len(senders)} sender(s)")
+            try:
+                run_job(job, send)
+                done = {'event': 'done', 'ok': True}
+                logging.info(f"Daemon job finished: {kind} for {len(senders)} sender(s)")
+            except Exception as e:
+                logging.exception(f"Daemon job failed: {kind} for {len(senders)} sender(s)")
+                done = {'event': 'done', 'ok': False, 'error': str(e)}
+            # Counted out before the client hears back, so a job it submits
+            # next is not told it queues behind this one
+            with self.lock:
+                self.waiting -= 1
+            send(done)
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def write(self, event):
+        self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            # A connection that sends nothing only checks the daemon is up
+            return
+        try:
+            job = parse_request(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as e:
+            self.write({'event': 'done', 'ok': False, 'error': f"Bad request: {e}"})
+            return
+        events = Queue()
+        self.write({'event': 'queued', 'position': self.server.runner.submit(job, events.put)})
+        while True:
+            event = events.get()
+            try:
+                self.write(event)
+            except OSError:
+                # The job keeps running; its results land in the exports
+                logging.info("Daemon client disconnected; the job continues")
+                return
+            if event['event'] == 'done':
+                return
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def daemon_listening(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+def serve(socket_path=DEFAULT_SOCKET):
+    if not hasattr(socket, 'AF_UNIX'):
+        raise SystemExit("The extraction daemon needs Unix domain sockets")
+    if os.path.exists(socket_path):
+        if daemon_listening(socket_path):
+            raise SystemExit(f"An extraction daemon is already listening on {socket_path}")
+        # Left behind by a daemon that did not shut down cleanly
+        os.remove(socket_path)
+
+    # Warmed before the first job; a first login may open the browser here
+    import Full_extractor
+    Full_extractor.authenticate_gmail()
+    discovery_document('gmail', 'v1')
+
+    # The socket can start jobs that delete mail, so only its owner may connect
+    old_umask = os.umask(0o177)
+    try:
+        server = JobServer(socket_path, JobHandler)
+    finally:
+        os.umask(old_umask)
+    server.runner = JobRunner()
+    threading.Thread(target=server.runner.work, name='extraction-jobs', daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info(f"Extraction daemon listening on {socket_path}")
+    print(f"Extraction daemon listening on {socket_path} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        logging.info("Extraction daemon stopped")
+
+def submit(request, socket_path=DEFAULT_SOCKET):
+    # Connects and sends the job right away, so OSError means no daemon is
+    # listening; the returned generator yields the job's events
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+    except OSError:
+        sock.close()
+        raise
+    return _events(sock)
+
+def _events(sock):
+    with sock, sock.makefile('r', encoding='utf-8') as f:
+        for line in f:
+            event = json.loads(line)
+            yield event
+            if event['event'] == 'done':
+                return
+    raise ConnectionError("The extraction daemon closed the connection before the job finished")
+
+def print_events(events):
+    # Shows a job's events on the terminal; returns whether the job succeeded
+    for event in events:
+        if event['event'] == 'queued' and event['position']:
+            print(f"Queued behind {event['position']} job(s)")
+        elif event['event'] == 'output':
+            sys.stdout.write(event['text'])
+            sys.stdout.flush()
+        elif event['event'] == 'progress':
+            msg_type, value, message = event['item'][:3]
+            print(message, end='\n' if msg_type == 'complete' else '\r', flush=True)
+        elif event['event'] == 'done':
+            if not event['ok']:
+                print(f"Job failed: {event['error']}")
+            return event['ok']
+    return False
+
+def relay_events(events, progress_queue):
+    # Puts a job's events on a GUI progress queue
+    for event in events:
+        if event['event'] == 'queued' and event['position']:
+            progress_queue.put(('status', 0, f"Queued behind {event['position']} job(s) in the daemon..."))
+        elif event['event'] == 'progress':
+            progress_queue.put(tuple(event['item']))
+        elif event['event'] == 'done' and not event['ok']:
+            progress_queue.put(('complete', 0, f"Daemon job failed: {event['error']}", "info"))
+
+def run_or_submit(socket_path, request, progress_queue, func, args):
+    # GUI worker thread target: hands the job to the daemon when one listens
+    # on socket_path and otherwise runs func(*args) in this process
+    if socket_path:
+        try:
+            events = submit(request, socket_path)
+        except OSError as e:
+            logging.info(f"No extraction daemon on {socket_path} ({e}); running in-process")
+        else:
+            try:
+                relay_events(events, progress_queue)
+            except (OSError, ValueError) as e:
+                logging.error(f"Lost the extraction daemon: {e}")
+                progress_queue.put(('complete', 0, f"Lost the extraction daemon: {e}", "info"))
+            return
+    func(*args)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Keep credentials, Gmail clients and export indexes warm and run extraction jobs sent over a Unix socket.")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"socket path (default: {DEFAULT_SOCKET} in the working directory)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    serve(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+import base64
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Offline stand-in for build('gmail', 'v1') used by benchmark.py. It answers
+# the calls the extractors make (messages.list/get/trash/modify/batchModify,
+# attachments.get, history.list, getProfile and HTTP batches) from a
+# synthetic mailbox whose messages are generated on demand from their index,
+# so a million-message mailbox costs no memory until it is fetched.
+
+WORDS = ('invoice order shipping account update offer weekly report meeting '
+         'payment receipt team project delivery review schedule customer '
+         'newsletter discount ticket reminder security password welcome').split()
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi']
+
+ATTACHMENT_TYPES = [
+    ('application/pdf', 'pdf'),
+    ('image/png', 'png'),
+    ('image/jpeg', 'jpg'),
+    ('application/zip', 'zip'),
+    ('text/csv', 'csv'),
+]
+
+# Gmail returns at most this many ids per messages.list page
+MAX_LIST_RESULTS = 500
+
+def b64(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def http_error(status, reason, retry_after=None):
+    headers = {'status': str(status)}
+    if retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    content = json.dumps({'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}}).encode('utf-8')
+    return HttpError(httplib2.Response(headers), content)
+
+class SyntheticMailbox:
+    # Message i is newest-first, internalDate spacing seconds apart, from
+    # senders[i % len(senders)]. Bodies are slices of one shared text block
+    # and attachments come from a pool of distinct_attachments payloads, so
+    # repeated files (logos, terms) look like they do in real mail.
+    def __init__(self, count, senders=('news@example.com',), seed=1, body_bytes=4000, attachment_ratio=0.2,
+                 attachment_bytes=100000, distinct_attachments=50, spacing=3600, end=None):
+        self.count = count
+        self.senders = list(senders)
+        self.seed = seed
+        self.body_bytes = body_bytes
+        self.attachment_ratio = attachment_ratio
+        self.attachment_bytes = attachment_bytes
+        self.distinct_attachments = max(1, distinct_attachments)
+        self.spacing = spacing
+        self.end = int(end or time.time())
+        text_random = random.Random(seed)
+        self.text = ' '.join(text_random.choice(WORDS) for _ in range(body_bytes // 3 + 1000))
+        self.attachment_cache = {}
+        self.trashed = set()
+        self.archived = set()
+        self.lock = threading.Lock()
+
+    def message_id(self, index):
+        return f'{index:016x}'
+
+    def index(self, msg_id):
+        index = int(msg_id, 16)
+        if not 0 <= index < self.count:
+            raise http_error(404, 'notFound')
+        return index
+
+    def timestamp(self, index):
+        return self.end - index * self.spacing
+
+    def sender_index(self, index):
+        return index % len(self.senders)
+
+    def matching(self, query, start=0):
+        # Indexes matching the from:/after:/before: filters build_query and
+        # build_sender_queries produce, from start on
+        senders = None
+        match = re.search(r'from:\(([^)]*)\)|from:(\S+)', query or '')
+        if match:
+            terms = [term.strip('"').lower() for term in (match.group(1) or match.group(2)).split(' OR ')]
+            senders = {n for n, sender in enumerate(self.senders) if any(term in sender.lower() for term in terms)}
+        after = re.search(r'after:(\d{4}/\d{2}/\d{2})', query or '')
+        before = re.search(r'before:(\d{4}/\d{2}/\d{2})', query or '')
+        after = datetime.strptime(after.group(1), '%Y/%m/%d').replace(tzinfo=timezone.utc).timestamp() if after else None
+        before = datetime.strptime(before.group(1), '%Y/%m/%d').replace(tzinfo=timezone.utc).timestamp() if before else None
+        for index in range(start, self.count):
+            if senders is not None and self.sender_index(index) not in senders:
+                continue
+            timestamp = self.timestamp(index)
+            if before is not None and timestamp >= before:
+                continue
+            if after is not None and timestamp < after:
+                # Older messages only get older
+                return
+            if index in self.trashed:
+                continue
+            yield index
+
+    def list_page(self, query, page_token=None, max_results=100):
+        max_results = min(max_results or 100, MAX_LIST_RESULTS)
+        start = int(page_token) if page_token else 0
+        messages = []
+        for index in self.matching(query, start):
+            if len(messages) == max_results:
+                return {'messages': messages, 'nextPageToken': str(index), 'resultSizeEstimate': self.count}
+            messages.append({'id': self.message_id(index), 'threadId': self.message_id(index)})
+        page = {'resultSizeEstimate': len(messages)}
+        if messages:
+            page['messages'] = messages
+        return page
+
+    def attachment_data(self, key):
+        data = self.attachment_cache.get(key)
+        if data is None:
+            attachment_random = random.Random(self.seed * 7919 + key)
+            size = max(1, int(self.attachment_bytes * attachment_random.uniform(0.2, 1.8)))
+            data = b64(attachment_random.randbytes(size)).rstrip('=')
+            with self.lock:
+                self.attachment_cache[key] = data
+        return data
+
+    def _body(self, rng):
+        size = max(1, int(self.body_bytes * rng.uniform(0.5, 1.5)))
+        start = rng.randrange(0, len(self.text) - size) if len(self.text) > size else 0
+        return self.text[start:start + size]
+
+    def _headers(self, index, rng, mime_type):
+        sender = self.senders[self.sender_index(index)]
+        date = datetime.fromtimestamp(self.timestamp(index), timezone.utc)
+        return [
+            {'name': 'From', 'value': f'{rng.choice(FIRST_NAMES)} <{sender}>'},
+            {'name': 'To', 'value': 'me@example.com'},
+            {'name': 'Subject', 'value': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))).capitalize()},
+            {'name': 'Date', 'value': format_datetime(date)},
+            {'name': 'Message-ID', 'value': f'<{self.message_id(index)}@example.com>'},
+            {'name': 'Content-Type', 'value': mime_type},
+        ]
+
+    def _parts(self, index, rng):
+        # The MIME shapes seen in practice: plain only, plain + html
+        # alternative, and mixed with attachments, sometimes with inline
+        # images under multipart/related
+        text = self._body(rng)
+        plain = {'partId': '0', 'mimeType': 'text/plain', 'filename': '', 'headers': [], 'body': {'size': len(text), 'data': b64(text)}}
+        if rng.random() < 0.15:
+            return 'text/plain', None, plain['body']
+        html_text = f'<html><body><p>{text}</p></body></html>'
+        html = {'partId': '1', 'mimeType': 'text/html', 'filename': '', 'headers': [], 'body': {'size': len(html_text), 'data': b64(html_text)}}
+        alternative = {'partId': '0', 'mimeType': 'multipart/alternative', 'filename': '', 'headers': [], 'body': {'size': 0}, 'parts': [plain, html]}
+        if rng.random() < 0.1:
+            image = self._attachment(index, rng, 'logo', ('image/png', 'png'))
+            alternative = {'partId': '0', 'mimeType': 'multipart/related', 'filename': '', 'headers': [], 'body': {'size': 0}, 'parts': [alternative, image]}
+        if rng.random() >= self.attachment_ratio:
+            return alternative['mimeType'], alternative['parts'], {'size': 0}
+        parts = [alternative]
+        for n in range(rng.choice((1, 1, 1, 2, 3))):
+            parts.append(self._attachment(index, rng, f'attachment{n + 1}', rng.choice(ATTACHMENT_TYPES)))
+        return 'multipart/mixed', parts, {'size': 0}
+
+    def _attachment(self, index, rng, name, kind):
+        key = rng.randrange(self.distinct_attachments)
+        data = self.attachment_data(key)
+        return {
+            'partId': '1',
+            'mimeType': kind[0],
+            'filename': f'{name}.{kind[1]}',
+            'headers': [{'name': 'Content-Disposition', 'value': f'attachment; filename="{name}.{kind[1]}"'}],
+            'body': {'attachmentId': f'{self.message_id(index)}.{key}', 'size': len(data) * 3 // 4}
+        }
+
+    def message(self, msg_id, format='full', metadata_headers=None):
+        index = self.index(msg_id)
+        rng = random.Random(self.seed * 1000003 + index)
+        message = {
+            'id': msg_id,
+            'threadId': msg_id,
+            'labelIds': ['INBOX'] if index not in self.archived else [],
+            'snippet': '',
+            'internalDate': str(self.timestamp(index) * 1000),
+            'sizeEstimate': 0,
+        }
+        if format == 'minimal':
+            return message
+        mime_type, parts, body = self._parts(index, rng)
+        headers = self._headers(index, rng, mime_type)
+        if format == 'metadata':
+            wanted = {name.lower() for name in metadata_headers or []}
+            message['payload'] = {'mimeType': mime_type, 'headers': [h for h in headers if not wanted or h['name'].lower() in wanted]}
+            return message
+        payload = {'partId': '', 'mimeType': mime_type, 'filename': '', 'headers': headers, 'body': body}
+        if parts:
+            payload['parts'] = parts
+        if format == 'raw':
+            message['raw'] = b64(self._mime(payload).as_bytes())
+            return message
+        message['payload'] = payload
+        return message
+
+    def _mime(self, part):
+        if part['mimeType'].startswith('multipart/'):
+            mime = MIMEMultipart(part['mimeType'].split('/', 1)[1])
+            for sub in part.get('parts', []):
+                mime.attach(self._mime(sub))
+        elif part['filename']:
+            key = int(part['body']['attachmentId'].rsplit('.', 1)[1])
+            data = base64.urlsafe_b64decode(self.attachment_data(key) + '==')
+            mime = MIMEApplication(data, _subtype=part['mimeType'].split('/', 1)[1], name=part['filename'])
+            mime.add_header('Content-Disposition', 'attachment', filename=part['filename'])
+        else:
+            text = base64.urlsafe_b64decode(part['body'].get('data', ''))
+            mime = MIMEText(text.decode('utf-8'), part['mimeType'].split('/', 1)[1], 'utf-8')
+        for header in part.get('headers', []):
+            if header['name'] not in ('Content-Type', 'Content-Disposition'):
+                mime[header['name']] = header['value']
+        return mime
+
+    def attachment(self, msg_id, attachment_id):
+        self.index(msg_id)
+        data = self.attachment_data(int(attachment_id.rsplit('.', 1)[1]))
+        return {'size': len(data) * 3 // 4, 'data': data}
+
+class FakeLatency:
+    # Round trip per HTTP request, plus per_item for each call in a batch;
+    # rate_limit_ratio of calls fail with 429 like an exhausted quota
+    def __init__(self, request=0.05, per_item=0.002, jitter=0.2, rate_limit_ratio=0.0, seed=1):
+        self.request = request
+        self.per_item = per_item
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def wait(self, items=0):
+        with self.lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        delay = (self.request + self.per_item * items) * factor
+        if delay > 0:
+            time.sleep(delay)
+
+    def rate_limited(self):
+        if not self.rate_limit_ratio:
+            return False
+        with self.lock:
+            return self.random.random() < self.rate_limit_ratio
+
+class FakeRequest:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self, num_retries=0):
+        self.service.latency.wait()
+        return self.service.call(self.handler)
+
+class FakeBatch:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self.requests) >= 100:
+            raise ValueError("Batch requests are limited to 100 calls")
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self):
+        self.service.latency.wait(len(self.requests))
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.service.call(request.handler), None
+            except HttpError as error:
+                response, exception = None, error
+            callback(request_id, response, exception)
+
+class FakeResource:
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+class FakeGmailService:
+    def __init__(self, mailbox, latency):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def call(self, handler):
+        name, func = handler
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency.rate_limited():
+            raise http_error(429, 'rateLimitExceeded', retry_after=0)
+        return func()
+
+    def _request(self, name, func):
+        return FakeRequest(self, (name, func))
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        mailbox = self.mailbox
+        messages = FakeResource(
+            list=lambda userId, q=None, maxResults=100, pageToken=None, **kwargs: self._request(
+                'list', lambda: mailbox.list_page(q, pageToken, maxResults)),
+            get=lambda userId, id, format='full', metadataHeaders=None, **kwargs: self._request(
+                'get', lambda: mailbox.message(id, format, metadataHeaders)),
+            trash=lambda userId, id: self._request('trash', lambda: self._trash([id])),
+            modify=lambda userId, id, body: self._request('modify', lambda: self._modify([id], body)),
+            batchModify=lambda userId, body: self._request('batchModify', lambda: self._modify(body['ids'], body)),
+            attachments=lambda: FakeResource(
+                get=lambda userId, messageId, id: self._request('attachments.get', lambda: mailbox.attachment(messageId, id)))
+        )
+        return FakeResource(
+            messages=lambda: messages,
+            history=lambda: FakeResource(
+                list=lambda userId, startHistoryId, **kwargs: self._request(
+                    'history.list', lambda: {'history': [], 'historyId': str(mailbox.count)})),
+            getProfile=lambda userId: self._request(
+                'getProfile', lambda: {'emailAddress': 'me@example.com', 'messagesTotal': mailbox.count, 'historyId': str(mailbox.count)})
+        )
+
+    def _trash(self, ids):
+        with self.mailbox.lock:
+            for msg_id in ids:
+                self.mailbox.trashed.add(self.mailbox.index(msg_id))
+        return {}
+
+    def _modify(self, ids, body):
+        with self.mailbox.lock:
+            for msg_id in ids:
+                if 'INBOX' in body.get('removeLabelIds', []):
+                    self.mailbox.archived.add(self.mailbox.index(msg_id))
+        return {}
+
+def fake_build(mailbox, latency):
+    # Same signature as googleapiclient.discovery.build; every client shares
+    # the mailbox like real clients share the account
+    services = []
+
+    def build(serviceName, version, credentials=None, **kwargs):
+        service = FakeGmailService(mailbox, latency)
+        services.append(service)
+        return service
+
+    build.services = services
+    return build
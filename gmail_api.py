@@ -0,0 +1,361 @@
+import base64
+import email
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from gmail_client import build, service_pool
+from metrics import metrics
+from rate_limiter import execute_request, is_retryable, limiter, record_error, retry_delay
+
+# Gmail caps messages.list at 500 ids per page
+MAX_PAGE_SIZE = 500
+
+def build_query(sender_email, start_date=None, end_date=None):
+    query = f'from:{sender_email}'
+    if start_date:
+        query += f' after:{start_date.strftime("%Y/%m/%d")}'
+    if end_date:
+        query += f' before:{end_date.strftime("%Y/%m/%d")}'
+    return query
+
+def iter_message_pages(service, query, page_size=MAX_PAGE_SIZE, max_retries=3, page_token=None):
+    # Yields each messages.list response so callers can start fetching
+    # details for page 1 while the next pages are still being listed.
+    # page_token resumes a listing that was interrupted.
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    while True:
+        started = time.monotonic()
+        try:
+            results = execute_request(service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=page_size,
+                pageToken=page_token
+            ), 'list', max_retries)
+        except HttpError as error:
+            logging.error(f"Failed to fetch emails: {error}")
+            return
+        except Exception as e:
+            logging.error(f"Unexpected error fetching emails: {e}")
+            return
+        metrics.stage_done('list', time.monotonic() - started, len(results.get('messages', [])))
+        yield results
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+# Fetch profiles map to messages.get formats. `fields` trims response
+# parts the parsers never read so less JSON is transferred and decoded.
+FETCH_PROFILES = {
+    'minimal': {'format': 'minimal', 'fields': 'id,threadId,internalDate'},
+    'metadata': {
+        'format': 'metadata',
+        'metadataHeaders': ['From', 'Subject', 'Date'],
+        'fields': 'id,threadId,internalDate,payload(mimeType,headers)'
+    },
+    'full': {'format': 'full', 'fields': 'id,threadId,internalDate,payload'},
+    'raw': {'format': 'raw', 'fields': 'id,threadId,internalDate,raw'},
+}
+
+HEADER_FIELDS = {'date', 'from', 'subject'}
+BODY_FIELDS = {'body', 'html_body', 'attachments'}
+
+def profile_for_fields(fields):
+    # Picks the lightest profile that still returns every field an exporter writes
+    fields = set(fields)
+    if fields & BODY_FIELDS:
+        return 'full'
+    if fields & HEADER_FIELDS:
+        return 'metadata'
+    return 'minimal'
+
+def payload_bytes(message):
+    # Size of the base64 data in a messages.get response, the bulk of what
+    # was downloaded
+    size = len(message.get('raw', ''))
+    parts = [message.get('payload', {})]
+    while parts:
+        part = parts.pop()
+        size += len(part.get('body', {}).get('data', ''))
+        parts.extend(part.get('parts', []))
+    return size
+
+def message_request(service, msg_id, profile='full'):
+    return service.users().messages().get(userId='me', id=msg_id, **FETCH_PROFILES[profile])
+
+def _part_to_payload(part):
+    payload = {
+        'mimeType': part.get_content_type(),
+        'filename': part.get_filename() or '',
+        'headers': [{'name': name, 'value': str(value)} for name, value in part.items()],
+        'body': {}
+    }
+    if part.is_multipart():
+        payload['parts'] = [_part_to_payload(sub) for sub in part.get_payload()]
+    else:
+        data = part.get_payload(decode=True) or b''
+        payload['body'] = {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode('ascii')}
+    return payload
+
+def normalize_message(message):
+    # raw responses carry the RFC 822 source; rebuild the payload tree the
+    # parsers expect from format='full'
+    if 'raw' in message and 'payload' not in message:
+        mime = email.message_from_bytes(base64.urlsafe_b64decode(message['raw']))
+        message['payload'] = _part_to_payload(mime)
+        del message['raw']
+    message.setdefault('payload', {}).setdefault('headers', [])
+    return message
+
+# Gmail accepts at most 100 calls in a single HTTP batch request
+MAX_BATCH_SIZE = 100
+
+# users.messages.batchModify takes up to 1000 ids per call
+MAX_BATCH_MODIFY_IDS = 1000
+
+def execute_batch(service, ids, make_request, method, batch_size=MAX_BATCH_SIZE, max_retries=3):
+    # Sends make_request(id) for every id through HTTP batch requests and
+    # returns {id: response} for the calls that succeeded. Only the
+    # sub-requests that failed with a retryable status are sent again.
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    responses = {}
+    pending = list(ids)
+
+    for attempt in range(max_retries):
+        failed = []
+        errors = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                retry = is_retryable(exception) and attempt < max_retries - 1
+                record_error(exception, method, retry)
+                if retry:
+                    failed.append(request_id)
+                    errors.append(exception)
+                else:
+                    logging.error(f"Batched {method} failed for {request_id}: {exception}")
+                return
+            responses[request_id] = response
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id in chunk:
+                batch.add(make_request(request_id), request_id=request_id)
+            limiter.acquire(method, len(chunk))
+            started = time.monotonic()
+            try:
+                batch.execute()
+            except Exception as e:
+                logging.error(f"Batch request failed: {e}")
+                metrics.inc('api_errors_total', method=f'{method}:batch', status='none')
+                failed.extend(request_id for request_id in chunk if request_id not in responses)
+            metrics.observe('api_request_seconds', time.monotonic() - started, method=f'{method}:batch')
+
+        if not failed:
+            break
+        if attempt < max_retries - 1:
+            delay = max(retry_delay(error, attempt) for error in errors) if errors else retry_delay(None, attempt)
+            logging.warning(f"{len(failed)} batched requests failed, retrying in {delay:.1f}s")
+            limiter.pause(delay)
+        pending = failed
+
+    return responses
+
+def parse_messages(parse_message, messages):
+    # Decodes a chunk of API responses into records. Also the unit of work
+    # sent to decode worker processes, so it only takes picklable arguments.
+    records = []
+    with metrics.stage('decode', len(messages)):
+        for message in messages:
+            try:
+                records.append(parse_message(normalize_message(message)))
+            except Exception as e:
+                logging.error(f"Error getting email details for {message.get('id')}: {e}")
+    return records
+
+def submit_decode(decoder, parse_message, messages):
+    # Worker processes record into their own copy of the metrics, so the
+    # decode stage is timed here, from submission to result
+    started = time.monotonic()
+    future = decoder.submit(parse_messages, parse_message, messages)
+    future.add_done_callback(lambda _: metrics.stage_done('decode', time.monotonic() - started, len(messages)))
+    return future
+
+def batch_get_messages(service, msg_ids, parse_message, batch_size=MAX_BATCH_SIZE, max_retries=3, profile='full'):
+    # Returns the parsed records in the same order as msg_ids, or the raw
+    # responses when parse_message is None
+    with metrics.stage('fetch', len(msg_ids)):
+        responses = execute_batch(
+            service,
+            msg_ids,
+            lambda msg_id: message_request(service, msg_id, profile),
+            'get',
+            batch_size,
+            max_retries
+        )
+    messages = [responses.pop(msg_id) for msg_id in msg_ids if msg_id in responses]
+    metrics.inc('bytes_downloaded_total', sum(payload_bytes(message) for message in messages), kind='message')
+    if parse_message is None:
+        return messages
+    return parse_messages(parse_message, messages)
+
+def open_decode_pool(processes):
+    # Optional process pool for the CPU-bound decode stage; parse_message
+    # must then be a module-level function so it can be pickled. Workers
+    # start on the first submit, from a fetch thread, so they are spawned:
+    # a forked child could inherit a lock (metrics, logging) held by
+    # another thread and hang.
+    if not processes:
+        return None
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+def chunk_records(result):
+    # A fetch chunk yields records directly, or a decode-pool future of them
+    return result.result() if isinstance(result, Future) else result
+
+def bulk_modify(service, msg_ids, add_label_ids=None, remove_label_ids=None, chunk_size=MAX_BATCH_MODIFY_IDS, max_retries=3, progress=None):
+    # Applies the label change with one batchModify call per chunk of ids
+    # and returns how many ids were modified.
+    chunk_size = min(chunk_size, MAX_BATCH_MODIFY_IDS)
+    body = {}
+    if add_label_ids:
+        body['addLabelIds'] = add_label_ids
+    if remove_label_ids:
+        body['removeLabelIds'] = remove_label_ids
+    total = len(msg_ids)
+    modified = 0
+    for start in range(0, total, chunk_size):
+        chunk = msg_ids[start:start + chunk_size]
+        try:
+            with metrics.stage('action', len(chunk)):
+                execute_request(service.users().messages().batchModify(
+                    userId='me',
+                    body=dict(body, ids=chunk)
+                ), 'batchModify', max_retries)
+            modified += len(chunk)
+        except Exception as e:
+            logging.error(f"Failed to modify {len(chunk)} emails starting at {chunk[0]}: {e}")
+        if progress:
+            progress(start + len(chunk), total)
+    return modified
+
+def bulk_trash(service, msg_ids, batch_size=MAX_BATCH_SIZE, max_retries=3, progress=None):
+    # Gmail has no batch trash endpoint and batchDelete needs the full
+    # https://mail.google.com/ scope and skips the bin, so trash calls are
+    # grouped into HTTP batch requests instead. Returns how many were trashed.
+    total = len(msg_ids)
+    trashed = 0
+    for start in range(0, total, batch_size):
+        chunk = msg_ids[start:start + batch_size]
+        with metrics.stage('action', len(chunk)):
+            responses = execute_batch(
+                service,
+                chunk,
+                lambda msg_id: service.users().messages().trash(userId='me', id=msg_id),
+                'trash',
+                batch_size,
+                max_retries
+            )
+        trashed += len(responses)
+        if progress:
+            progress(start + len(chunk), total)
+    return trashed
+
+def modify_each(service, msg_ids, action, max_retries=3, progress=None):
+    # One trash or modify call per message, for runs with bulk_actions off.
+    # Returns how many succeeded.
+    total = len(msg_ids)
+    done = 0
+    for i, msg_id in enumerate(msg_ids, 1):
+        try:
+            with metrics.stage('action', 1):
+                if action == 'delete':
+                    execute_request(service.users().messages().trash(userId='me', id=msg_id), 'trash', max_retries)
+                else:
+                    execute_request(service.users().messages().modify(
+                        userId='me',
+                        id=msg_id,
+                        body={'removeLabelIds': ['INBOX']}
+                    ), 'modify', max_retries)
+            done += 1
+        except HttpError as error:
+            logging.error(f"Failed to {action} email {msg_id}: {error}")
+        except Exception as e:
+            logging.error(f"Unexpected error in {action} for {msg_id}: {e}")
+        if progress:
+            progress(i, total)
+    return done
+
+class MessageFetcher:
+    # Runs batch_get_messages on a thread pool. httplib2 is not thread-safe,
+    # so every worker thread builds its own Gmail client from the shared
+    # credentials. Results are yielded in the order the ids were given.
+    # With decode_processes the threads only do network I/O and hand each
+    # chunk of raw responses to a process pool for decoding.
+    def __init__(self, creds, parse_message, workers=4, batch_size=MAX_BATCH_SIZE, max_retries=3, profile='full', decode_processes=0):
+        self.creds = creds
+        self.parse_message = parse_message
+        self.workers = max(1, workers)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.profile = profile
+        self._local = threading.local()
+        self._services = []
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gmail-fetch')
+        self.decoder = open_decode_pool(decode_processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.decoder:
+            self.decoder.shutdown(wait=True)
+        # The worker threads are gone; their clients go to the next pool
+        service_pool.give_back(self.creds, self._services)
+        self._services = []
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = service_pool.take(self.creds) or build('gmail', 'v1', credentials=self.creds)
+            self._local.service = service
+            self._services.append(service)
+        return service
+
+    def _fetch_chunk(self, msg_ids):
+        if self.decoder is None:
+            return batch_get_messages(self._service(), msg_ids, self.parse_message,
+                                      self.batch_size, self.max_retries, self.profile)
+        messages = batch_get_messages(self._service(), msg_ids, None,
+                                      self.batch_size, self.max_retries, self.profile)
+        # Returned without waiting so this thread can start its next fetch
+        return submit_decode(self.decoder, self.parse_message, messages)
+
+    def map(self, msg_ids):
+        # Pulls ids lazily so listing can continue while earlier chunks are
+        # being fetched, keeping at most two chunks per worker in flight.
+        in_flight = deque()
+        chunk = []
+        for msg_id in msg_ids:
+            chunk.append(msg_id)
+            if len(chunk) == self.batch_size:
+                in_flight.append(self.executor.submit(self._fetch_chunk, chunk))
+                chunk = []
+                while len(in_flight) >= self.workers * 2:
+                    yield from chunk_records(in_flight.popleft().result())
+        if chunk:
+            in_flight.append(self.executor.submit(self._fetch_chunk, chunk))
+        while in_flight:
+            yield from chunk_records(in_flight.popleft().result())
+
+    def fetch(self, msg_ids):
+        return list(self.map(msg_ids))
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+
+# Startup helpers shared by the extractors. The Google client libraries
+# (googleapiclient.discovery, google-auth's requests transport and the OAuth
+# flow) take most of the launch time, so they are imported on first use
+# instead of at module import.
+
+TOKEN_FILE = 'token.json'
+CLIENT_SECRETS_FILE = 'credentials.json'
+
+# Where fetched discovery documents are kept when the installed client does
+# not ship a static copy
+DISCOVERY_DIRNAME = 'discovery'
+DISCOVERY_URL = 'https://{api}.googleapis.com/$discovery/rest?version={apiVersion}'
+
+MAX_IDLE_SERVICES = 16
+
+_documents = {}
+_credentials = {}
+_documents_lock = threading.Lock()
+_credentials_lock = threading.Lock()
+
+def _static_document(serviceName, version):
+    # google-api-python-client 2.x ships the discovery documents it knows
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        return None
+    return get_static_doc(serviceName, version)
+
+def _cached_document(serviceName, version):
+    filename = os.path.join(DISCOVERY_DIRNAME, f'{serviceName}.{version}.json')
+    if os.path.exists(filename):
+        with open(filename, encoding='utf-8') as f:
+            return f.read()
+    import httplib2
+    logging.info(f"Fetching the {serviceName} {version} discovery document")
+    response, content = httplib2.Http().request(DISCOVERY_URL.format(api=serviceName, apiVersion=version))
+    if response.status >= 400:
+        raise RuntimeError(f"Could not fetch the {serviceName} {version} discovery document (HTTP {response.status})")
+    document = content.decode('utf-8')
+    os.makedirs(DISCOVERY_DIRNAME, exist_ok=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        f.write(document)
+    os.replace(tmp_filename, filename)
+    return document
+
+def discovery_document(serviceName, version):
+    # Read once per process; every later build() reuses the same text
+    key = (serviceName, version)
+    with _documents_lock:
+        document = _documents.get(key)
+        if document is None:
+            document = _static_document(serviceName, version) or _cached_document(serviceName, version)
+            _documents[key] = document
+    return document
+
+def build(serviceName, version, credentials=None, **kwargs):
+    # Drop-in for googleapiclient.discovery.build that loads the discovery
+    # document locally, at most once per process. Clients are still built per
+    # thread, since httplib2 connections are not thread-safe.
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(discovery_document(serviceName, version), credentials=credentials, **kwargs)
+
+class ServicePool:
+    # Idle Gmail clients left by finished fetch pools, kept per credentials
+    # so the next run in the same process (a daemon job, another GUI run)
+    # starts with clients that are built and still hold open connections.
+    # A client is only ever used by one thread at a time.
+    def __init__(self, max_idle=MAX_IDLE_SERVICES):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def take(self, creds):
+        with self.lock:
+            entry = self.idle.get(id(creds))
+            if entry and entry[1]:
+                return entry[1].pop()
+        return None
+
+    def give_back(self, creds, services):
+        with self.lock:
+            # The credentials are stored too, so their id is not reused
+            idle = self.idle.setdefault(id(creds), (creds, []))[1]
+            idle.extend(services[:max(0, self.max_idle - len(idle))])
+
+service_pool = ServicePool()
+
+def _authorize(creds, scopes, token_file, secrets_file):
+    from google.oauth2.credentials import Credentials
+    if creds is None and os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, scopes)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
+            creds.refresh(Request())
+        else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(secrets_file, scopes)
+            creds = flow.run_local_server(port=0)
+        with open(token_file, 'w') as token:
+            token.write(creds.to_json())
+    return creds
+
+def get_credentials(scopes, token_file=TOKEN_FILE, secrets_file=CLIENT_SECRETS_FILE):
+    # Credentials live for the whole process, so repeated runs in one GUI
+    # session skip reading token.json and only refresh once the access token
+    # has expired. The lock keeps two threads from opening two login flows.
+    key = (os.path.abspath(token_file), tuple(scopes))
+    with _credentials_lock:
+        creds = _credentials.get(key)
+    if creds is not None and creds.valid:
+        return creds
+    with _credentials_lock:
+        creds = _authorize(_credentials.get(key), scopes, token_file, secrets_file)
+        _credentials[key] = creds
+    return creds
+
+def preload(serviceName='gmail', version='v1'):
+    # Warms the imports and the discovery document in the background while a
+    # GUI window is already up, so the first run does not pay for them
+    def load():
+        try:
+            import googleapiclient.discovery
+            import google.oauth2.credentials
+            import google.auth.transport.requests
+            discovery_document(serviceName, version)
+        except Exception as e:
+            logging.debug(f"Preloading the Gmail client failed: {e}")
+    threading.Thread(target=load, daemon=True).start()
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import time
+from googleapiclient.errors import HttpError
+from gmail_api import MAX_PAGE_SIZE, execute_batch, iter_message_pages, message_request
+from metrics import metrics
+from rate_limiter import execute_request
+
+STATE_FILENAME = 'sync_state.json'
+
+# messages.list skips these by default, so the incremental path does too
+EXCLUDED_LABELS = {'SPAM', 'TRASH', 'DRAFT'}
+
+# Page tokens for the history path are offsets into the matching messages
+HISTORY_TOKEN = 'history:'
+
+class HistoryExpired(Exception):
+    pass
+
+def load_checkpoint(state_file, sender_email):
+    if not os.path.isfile(state_file):
+        return None
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get(sender_email)
+    except Exception as e:
+        logging.error(f"Error reading sync state: {e}")
+        return None
+
+def save_checkpoint(state_file, sender_email, history_id):
+    state = {}
+    if os.path.isfile(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            logging.error(f"Error reading sync state: {e}")
+    state[sender_email] = history_id
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def get_history_id(service, max_retries=3):
+    try:
+        profile = execute_request(service.users().getProfile(userId='me'), 'getProfile', max_retries)
+        return profile.get('historyId')
+    except Exception as e:
+        logging.error(f"Failed to read mailbox historyId: {e}")
+        return None
+
+def iter_added_messages(service, start_history_id, max_retries=3):
+    page_token = None
+    seen = set()
+    while True:
+        started = time.monotonic()
+        try:
+            results = execute_request(service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                maxResults=MAX_PAGE_SIZE,
+                pageToken=page_token
+            ), 'history.list', max_retries)
+        except HttpError as error:
+            # Gmail only keeps about a week of history; older ids return 404
+            if error.resp.status == 404:
+                raise HistoryExpired(start_history_id)
+            raise
+        metrics.stage_done('list', time.monotonic() - started)
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                msg = added['message']
+                if msg['id'] in seen or EXCLUDED_LABELS & set(msg.get('labelIds', [])):
+                    continue
+                seen.add(msg['id'])
+                yield msg
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def filter_from_sender(service, messages, sender_email, max_retries=3):
+    # history.list is mailbox-wide, so look at the From header of each added
+    # message (metadata only) to keep the ones the from: query would match
+    responses = execute_batch(
+        service,
+        [msg['id'] for msg in messages],
+        lambda msg_id: message_request(service, msg_id, 'metadata'),
+        'get',
+        max_retries=max_retries
+    )
+    if len(responses) < len(messages):
+        # Skipping them would lose those messages for good once the
+        # checkpoint moves past them; the caller lists the query instead
+        raise RuntimeError(f"{len(messages) - len(responses)} of {len(messages)} metadata requests failed")
+    sender = sender_email.lower()
+    matching = []
+    for msg in messages:
+        response = responses[msg['id']]
+        headers = response.get('payload', {}).get('headers', [])
+        from_email = next((header['value'] for header in headers if header['name'] == 'From'), '')
+        if sender in from_email.lower():
+            matching.append({'id': msg['id'], 'threadId': msg.get('threadId')})
+    return matching
+
+def iter_sync_pages(service, sender_email, query, start_history_id=None, max_retries=3, page_token=None):
+    # Yields pages shaped like messages.list responses. With a checkpoint
+    # only messages added since then are returned; without one, or when the
+    # history has expired, this falls back to listing the whole query.
+    # page_token is a nextPageToken from an earlier page of the same call.
+    if start_history_id:
+        try:
+            added = list(iter_added_messages(service, start_history_id, max_retries))
+            matching = filter_from_sender(service, added, sender_email, max_retries) if added else []
+            logging.info(f"Incremental sync found {len(matching)} new emails from {sender_email}")
+            first = int(page_token[len(HISTORY_TOKEN):]) if page_token and page_token.startswith(HISTORY_TOKEN) else 0
+            # Like messages.list, nothing new still gives one empty page, so
+            # the caller sees the listing finish
+            for start in range(first, max(len(matching), 1), MAX_PAGE_SIZE):
+                page = {'messages': matching[start:start + MAX_PAGE_SIZE], 'resultSizeEstimate': len(matching)}
+                if start + MAX_PAGE_SIZE < len(matching):
+                    page['nextPageToken'] = f'{HISTORY_TOKEN}{start + MAX_PAGE_SIZE}'
+                yield page
+            return
+        except HistoryExpired:
+            logging.warning(f"History {start_history_id} expired for {sender_email}, falling back to a full listing")
+        except Exception as e:
+            logging.error(f"Incremental sync failed for {sender_email}, falling back to a full listing: {e}")
+    if page_token and page_token.startswith(HISTORY_TOKEN):
+        page_token = None
+    yield from iter_message_pages(service, query, max_retries=max_retries, page_token=page_token)
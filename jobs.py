@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import deque
+from exporters import CsvStreamWriter, csv_ids
+from gmail_api import MessageFetcher, bulk_modify, bulk_trash, modify_each
+from history_sync import STATE_FILENAME, get_history_id, iter_sync_pages, load_checkpoint, save_checkpoint
+from message_store import open_store
+
+JOBS_DIRNAME = 'jobs'
+
+def job_path(directory, *key_parts):
+    # One journal per sender/query/output combination
+    key = hashlib.sha1('\0'.join(str(part) for part in key_parts).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(directory, JOBS_DIRNAME, f'{key}.jsonl')
+
+def output_offsets(outputs):
+    return {path: os.path.getsize(path) if os.path.isfile(path) else None for path in outputs}
+
+class JobJournal:
+    # Append-only log of an extraction run. A line is fsynced each time a
+    # listing page has been completely written to the outputs, recording the
+    # page's message ids, the token of the next page and the byte size of
+    # every output file. A killed run is resumed by cutting the outputs back
+    # to the last recorded sizes and listing again from the saved token. A
+    # line torn by the kill is ignored.
+    def __init__(self, path, outputs=()):
+        self.path = path
+        self.outputs = list(outputs)
+        self.listed = []
+        self.page_token = None
+        self.listing_done = False
+        self.resumed = False
+        self.sync = None
+        self.file = None
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.page_of = {}
+        self.seq = 0
+        self.done_seq = -1
+
+    def _load(self):
+        offsets = None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                offsets = entry['offsets']
+                if 'ids' in entry:
+                    self.listed.extend({'id': msg_id} for msg_id in entry['ids'])
+                    self.page_token = entry['next']
+                    self.listing_done = entry['next'] is None
+        return offsets
+
+    def open(self):
+        # Restores the outputs of an interrupted run, then starts logging
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        offsets = self._load() if os.path.isfile(self.path) else None
+        if offsets is not None:
+            self.resumed = True
+            for path, size in offsets.items():
+                if not os.path.isfile(path):
+                    continue
+                # Rows written after the last committed page are fetched again
+                if size:
+                    os.truncate(path, size)
+                else:
+                    os.remove(path)
+            logging.info(f"Resuming job {self.path} after {len(self.listed)} listed messages")
+            self.file = open(self.path, 'a', encoding='utf-8')
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8')
+            self._append({'offsets': output_offsets(self.outputs)})
+        return self
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _append(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _commit_ready(self):
+        # Pages are committed in listing order once every record they
+        # produced has been written
+        while self.pending:
+            entry = self.pending[0]
+            if entry['last'] is not None and entry['seq'] > self.done_seq:
+                return
+            self.pending.popleft()
+            for msg_id in entry['new_ids']:
+                self.page_of.pop(msg_id, None)
+            if self.sync:
+                self.sync()
+            self._append({'ids': entry['ids'], 'next': entry['next'], 'offsets': output_offsets(self.outputs)})
+
+    def track(self, pages, existing_ids):
+        # Wraps the page stream; yields nothing when the journal shows the
+        # listing already finished. This may run on the engine's listing
+        # thread, so commits (which flush the outputs) are left to the
+        # thread that writes records. A listing that stops on an error ends
+        # on a page with a next token, or with no page at all, so
+        # listing_done stays False.
+        if self.listing_done:
+            return
+        for page in pages:
+            self.listing_done = not page.get('nextPageToken')
+            ids = [msg['id'] for msg in page.get('messages', [])]
+            new_ids = [msg_id for msg_id in ids if msg_id not in existing_ids]
+            with self.lock:
+                entry = {'seq': self.seq, 'ids': ids, 'new_ids': new_ids, 'last': new_ids[-1] if new_ids else None, 'next': page.get('nextPageToken')}
+                self.seq += 1
+                for msg_id in new_ids:
+                    self.page_of[msg_id] = entry
+                self.pending.append(entry)
+            yield page
+
+    def record_written(self, msg_id):
+        # Records arrive in listing order, so once one is written every
+        # earlier page is complete, even if some of its messages failed
+        with self.lock:
+            entry = self.page_of.get(msg_id)
+            if entry is None:
+                return
+            self.done_seq = max(self.done_seq, entry['seq'] if msg_id == entry['last'] else entry['seq'] - 1)
+            self._commit_ready()
+
+    def complete(self):
+        # Called once the fetch stage has drained
+        with self.lock:
+            self.done_seq = self.seq
+            self._commit_ready()
+
+    def messages(self, listed_now):
+        # Every message of the job, including pages listed before a restart
+        return self.listed + listed_now
+
+    def finish(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+# Menu choice -> action run on the listed messages after the export
+ACTIONS = {'2': 'delete', '3': 'archive'}
+
+ACTION_STAGES = {'delete': 'Deleting', 'archive': 'Archiving'}
+
+def unfetched(listed, existing_ids, fetched_ids):
+    # Ids of listed messages left out of the exports because their fetch or
+    # decoding failed
+    return {msg['id'] for msg in listed if msg['id'] not in existing_ids} - set(fetched_ids)
+
+def keep_checkpoint(sender_email, listing_done, missing):
+    # The checkpoint only moves once every message up to it is exported, so
+    # the next incremental run looks at the failed ones again
+    reason = f"{missing} emails could not be fetched" if listing_done else "the listing stopped early"
+    logging.warning(f"Not advancing the sync checkpoint for {sender_email}: {reason}")
+
+def open_engine(creds, parse_message, profile, config, decode_processes=None):
+    # The asyncio engine when config.json selects it, otherwise None for the
+    # threaded MessageFetcher
+    if config.get('engine') != 'asyncio':
+        return None
+    # asyncio is only imported for the runs that use it
+    from async_engine import AsyncExtractor
+    if decode_processes is None:
+        decode_processes = config.get('decode_processes', 0)
+    return AsyncExtractor(creds, parse_message, config.get('fetch_workers', 4), profile=profile, decode_processes=decode_processes)
+
+def fetch_new_emails(creds, engine, pages, existing_ids, parse_message, profile, config, on_record, progress=None, decode_processes=None):
+    # Fetches every listed message that is not exported yet and hands each
+    # record to on_record as soon as it arrives. progress(stage, done, total)
+    # takes the same arguments as ProgressBus.update. Returns the listed
+    # messages.
+    def report(done, total):
+        if progress:
+            progress('Processing', done, total)
+
+    if engine:
+        messages, _ = engine.run_extract(None, existing_ids, pages=pages, progress=report, on_record=on_record)
+        return messages
+
+    if decode_processes is None:
+        decode_processes = config.get('decode_processes', 0)
+    messages = []
+
+    def new_message_ids():
+        for page in pages:
+            for msg in page.get('messages', []):
+                messages.append(msg)
+                if msg['id'] not in existing_ids:
+                    yield msg['id']
+            report(len(messages), max(page.get('resultSizeEstimate', 0), len(messages)))
+
+    with MessageFetcher(creds, parse_message, config.get('fetch_workers', 4), profile=profile, decode_processes=decode_processes) as fetcher:
+        for email_details in fetcher.map(new_message_ids()):
+            on_record(email_details)
+    return messages
+
+def apply_action(service, engine, messages, action, config, progress=None):
+    # 'delete' (to the bin) or 'archive'. Bulk calls unless bulk_actions is
+    # off, then one call per message, through the asyncio engine if any.
+    # Returns how many messages were changed.
+    msg_ids = [msg['id'] for msg in messages]
+
+    def report(done, total):
+        if progress:
+            progress(ACTION_STAGES[action], done, total)
+
+    if config.get('bulk_actions', True):
+        if action == 'delete':
+            return bulk_trash(service, msg_ids, progress=report)
+        return bulk_modify(service, msg_ids, remove_label_ids=['INBOX'], progress=report)
+    if engine:
+        return engine.run_action(messages, action, report)
+    return modify_each(service, msg_ids, action, progress=report)
+
+class SenderExport:
+    # One sender's extraction as Full_extractor and both GUIs run it. With
+    # incremental on, only messages added since the sender's checkpoint are
+    # listed; the historyId is read before listing so nothing arriving
+    # mid-run is skipped. A journal lets a killed run resume, and every
+    # fetched record goes to the local store and, unless
+    # write_csv is off, straight into the CSV. The sync state, journal and
+    # store live in directory, by default the CSV's. Callers report the
+    # outcome of fetch() and then call finish().
+    def __init__(self, creds, service, sender_email, query, csv_filename, csv_fields, config, directory=None, dated=False, key_parts=(), write_csv=True, preamble=None):
+        self.creds = creds
+        self.service = service
+        self.sender_email = sender_email
+        self.query = query
+        self.csv_filename = csv_filename
+        self.csv_fields = csv_fields
+        self.config = config
+        self.directory = directory or os.path.dirname(csv_filename)
+        self.state_file = os.path.join(self.directory, STATE_FILENAME)
+        self.history_id = get_history_id(service) if config.get('incremental') else None
+        # A date range lists only part of the mailbox, so it never uses or
+        # moves the checkpoint
+        self.start_history_id = load_checkpoint(self.state_file, sender_email) if self.history_id and not dated else None
+        # Opening the journal of an interrupted run cuts the CSV back to the
+        # last committed page, so the exported ids are read afterwards
+        self.journal = JobJournal(job_path(self.directory, sender_email, query, self.start_history_id, *key_parts, csv_filename), [csv_filename] if write_csv else []).open()
+        try:
+            self.existing_ids = csv_ids.read(csv_filename)
+        except Exception as e:
+            logging.error(f"Error reading existing CSV: {e}")
+            self.existing_ids = set()
+        self.write_csv = write_csv
+        self.preamble = preamble
+        self.engine = None
+        self.messages = []
+        self.new_ids = []
+        self.missing = set()
+        self.total = 0
+
+    def fetch(self, parse_message, profile, progress=None, decode_processes=None):
+        # Returns every message of the job, including pages listed before a restart
+        self.engine = open_engine(self.creds, parse_message, profile, self.config, decode_processes)
+
+        def count_listed(pages):
+            # Counted as each page is listed: the CSV preamble reads the
+            # total with the first record, which can arrive before the
+            # first progress report
+            listed = 0
+            for page in pages:
+                listed += len(page.get('messages', []))
+                self.total = max(page.get('resultSizeEstimate', 0), listed)
+                yield page
+
+        with open_store(self.directory) as store, CsvStreamWriter(self.csv_filename, self.csv_fields, self.preamble) as csv_writer:
+            def save_record(email_details):
+                store.add(email_details, self.sender_email)
+                if self.write_csv:
+                    csv_writer.write(email_details)
+                self.new_ids.append(email_details['id'])
+                self.journal.record_written(email_details['id'])
+
+            def sync_outputs():
+                csv_writer.flush(sync=True)
+                store.flush()
+
+            self.journal.sync = sync_outputs
+            pages = count_listed(self.journal.track(iter_sync_pages(self.service, self.sender_email, self.query, self.start_history_id, page_token=self.journal.page_token), self.existing_ids))
+            listed = fetch_new_emails(self.creds, self.engine, pages, self.existing_ids, parse_message, profile, self.config, save_record, progress, decode_processes)
+            self.journal.complete()
+        self.missing = unfetched(listed, self.existing_ids, self.new_ids)
+        self.messages = self.journal.messages(listed)
+        return self.messages
+
+    def finish(self, action=None, progress=None):
+        # Moves the checkpoint forward, runs the delete/archive action on the
+        # listed messages and closes the job. Returns how many were changed.
+        if self.history_id:
+            if self.journal.listing_done and not self.missing:
+                save_checkpoint(self.state_file, self.sender_email, self.history_id)
+            else:
+                keep_checkpoint(self.sender_email, self.journal.listing_done, len(self.missing))
+        changed = 0
+        if action and self.missing:
+            # They are in neither the CSV nor the store, so they stay in the mailbox
+            logging.warning(f"Not applying {action} to {len(self.missing)} emails that were not exported")
+        messages = [msg for msg in self.messages if msg['id'] not in self.missing]
+        if action and messages:
+            changed = apply_action(self.service, self.engine, messages, action, self.config, progress)
+        self.journal.finish()
+        return changed
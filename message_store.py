@@ -0,0 +1,173 @@
+import os
+import sqlite3
+from date_utils import message_timestamp
+
+STORE_FILENAME = 'messages.db'
+
+# SQLite caps the number of bound parameters per statement
+_ID_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    date TEXT,
+    timestamp INTEGER,
+    from_email TEXT,
+    subject TEXT,
+    body TEXT,
+    html_body TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_sender_timestamp ON messages (sender, timestamp);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT,
+    mime_type TEXT,
+    size INTEGER,
+    path TEXT,
+    sha256 TEXT,
+    PRIMARY KEY (message_id, position)
+);
+"""
+
+class MessageStore:
+    # Local copy of every fetched message, keyed by Gmail id, so exports can
+    # be regenerated in any format or date range without calling the API.
+    def __init__(self, path, batch_size=500):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def add(self, record, sender):
+        self.pending.append((record, sender))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        messages = []
+        attachments = []
+        spooled_ids = []
+        for record, sender in self.pending:
+            messages.append((
+                record['id'],
+                sender,
+                record.get('date', ''),
+                message_timestamp(record),
+                record.get('from', ''),
+                record.get('subject', ''),
+                record.get('body', ''),
+                record.get('html_body', '')
+            ))
+            if any(att.get('path') for att in record.get('attachments', [])):
+                spooled_ids.append((record['id'],))
+            for position, att in enumerate(record.get('attachments', [])):
+                attachments.append((
+                    record['id'],
+                    position,
+                    att['filename'],
+                    att['mimeType'],
+                    att.get('size'),
+                    att.get('path'),
+                    att.get('sha256')
+                ))
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)', messages
+            )
+            # Records without downloaded files (simple mode, the other
+            # scripts) must not replace rows that point at them
+            self.conn.executemany('DELETE FROM attachments WHERE message_id = ?', spooled_ids)
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO attachments (message_id, position, filename, mime_type, size, path, sha256) VALUES (?, ?, ?, ?, ?, ?, ?)', attachments
+            )
+        self.pending = []
+
+    def _where(self, sender, start_date=None, end_date=None):
+        clause = 'sender = ?'
+        params = [sender]
+        # Same bounds as the Gmail after:/before: query
+        if start_date:
+            clause += ' AND timestamp >= ?'
+            params.append(int(start_date.timestamp()))
+        if end_date:
+            clause += ' AND timestamp < ?'
+            params.append(int(end_date.timestamp()))
+        return clause, params
+
+    def count(self, sender, start_date=None, end_date=None):
+        self.flush()
+        clause, params = self._where(sender, start_date, end_date)
+        return self.conn.execute(f'SELECT COUNT(*) FROM messages WHERE {clause}', params).fetchone()[0]
+
+    def _rows_to_records(self, rows):
+        ids = [row[0] for row in rows]
+        attachments = {msg_id: [] for msg_id in ids}
+        placeholders = ','.join('?' * len(ids))
+        for message_id, filename, mime_type, size, path, sha256 in self.conn.execute(
+            f'SELECT message_id, filename, mime_type, size, path, sha256 FROM attachments '
+            f'WHERE message_id IN ({placeholders}) ORDER BY message_id, position', ids
+        ):
+            attachments[message_id].append({'filename': filename, 'mimeType': mime_type, 'size': size, 'path': path, 'sha256': sha256})
+        for msg_id, date, timestamp, from_email, subject, body, html_body in rows:
+            yield {
+                'id': msg_id,
+                'date': date,
+                'timestamp': timestamp,
+                'from': from_email,
+                'subject': subject,
+                'body': body,
+                'html_body': html_body,
+                'attachments': attachments[msg_id]
+            }
+
+    def iter_messages(self, sender, start_date=None, end_date=None):
+        # Yields records in the shape parse_email returns, in insertion
+        # order, reading a chunk of rows at a time
+        self.flush()
+        columns = 'id, date, timestamp, from_email, subject, body, html_body'
+        clause, params = self._where(sender, start_date, end_date)
+        cursor = self.conn.execute(f'SELECT {columns} FROM messages WHERE {clause} ORDER BY rowid', params)
+        while True:
+            rows = cursor.fetchmany(_ID_CHUNK)
+            if not rows:
+                return
+            yield from self._rows_to_records(rows)
+
+    def select(self, sender, start_date=None, end_date=None):
+        return StoredMessages(self, sender, start_date, end_date)
+
+class StoredMessages:
+    # Re-iterable view over a store query, usable wherever the exporters
+    # previously took the in-memory list of records
+    def __init__(self, store, sender, start_date=None, end_date=None):
+        self.store = store
+        self.sender = sender
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def __len__(self):
+        return self.store.count(self.sender, self.start_date, self.end_date)
+
+    def __iter__(self):
+        return self.store.iter_messages(self.sender, self.start_date, self.end_date)
+
+def open_store(directory):
+    return MessageStore(os.path.join(directory, STORE_FILENAME))
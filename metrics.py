@@ -0,0 +1,213 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Every metric a run can record: name -> (type, help). Names follow the
+# Prometheus conventions and get PREFIX in the textfile export.
+METRICS = {
+    'api_calls_total': ('counter', 'Gmail API calls sent, including retries and calls inside HTTP batches'),
+    'quota_units_total': ('counter', 'Gmail quota units consumed'),
+    'api_retries_total': ('counter', 'API calls retried after a retryable error'),
+    'api_rate_limited_total': ('counter', 'API calls rejected with 429 or 403 rateLimitExceeded'),
+    'api_errors_total': ('counter', 'API calls that failed for good'),
+    'rate_limit_wait_seconds_total': ('counter', 'Time spent waiting for the shared rate limiter'),
+    'bytes_downloaded_total': ('counter', 'Base64 message and attachment data received'),
+    'bytes_written_total': ('counter', 'Bytes written to export files and the attachment store'),
+    'stage_items_total': ('counter', 'Messages handled by each stage'),
+    'api_request_seconds': ('histogram', 'Latency of single API calls and HTTP batch requests'),
+    'stage_seconds': ('histogram', 'Time spent in one unit of work of each stage'),
+}
+
+PREFIX = 'gmail_extractor_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    # Process-wide counters and latency histograms for one run. Every thread
+    # that fetches, decodes or writes records into the same registry; the
+    # decode worker processes are timed from the parent, since their own
+    # copies of the registry are never read back.
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def stage(self, stage, items=0):
+        # Times one unit of work (a listing page, a fetch chunk, an export)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stage_done(stage, time.monotonic() - started, items)
+
+    def stage_done(self, stage, seconds, items=0):
+        self.observe('stage_seconds', seconds, stage=stage)
+        if items:
+            self.inc('stage_items_total', items, stage=stage)
+
+    def total(self, name):
+        with self.lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def report(self, **info):
+        # JSON-friendly snapshot: counters and histograms keyed by their
+        # labels ("method=get"), plus a per-stage throughput summary
+        with self.lock:
+            counters = {}
+            for (name, key), value in sorted(self.counters.items()):
+                if key:
+                    counters.setdefault(name, {})[','.join(f'{k}={v}' for k, v in key)] = value
+                else:
+                    counters[name] = value
+            histograms = {}
+            for (name, key), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                buckets['+Inf'] = histogram['count']
+                histograms.setdefault(name, {})[','.join(f'{k}={v}' for k, v in key)] = {
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 6),
+                    'mean': round(histogram['sum'] / histogram['count'], 6) if histogram['count'] else 0,
+                    'max': round(histogram['max'], 6),
+                    'buckets': buckets
+                }
+            duration = time.time() - self.started
+        stages = {}
+        for label, seconds in histograms.get('stage_seconds', {}).items():
+            stage = label.split('=', 1)[1]
+            items = counters.get('stage_items_total', {}).get(label, 0)
+            # Summed over every thread, so parallel stages can exceed the
+            # run's wall time
+            stages[stage] = {
+                'busy_seconds': seconds['sum'],
+                'items': items,
+                'items_per_busy_second': round(items / seconds['sum'], 2) if seconds['sum'] else None
+            }
+        return dict(info, **{
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'duration_seconds': round(duration, 3),
+            'stages': stages,
+            'counters': counters,
+            'histograms': histograms
+        })
+
+    def prometheus_lines(self, **labels):
+        extra = tuple(sorted((name, str(value)) for name, value in labels.items()))
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(histogram, buckets=list(histogram['buckets'])) for key, histogram in self.histograms.items()}
+            started = self.started
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = sorted((key, value) for (metric, key), value in (counters.items() if kind == 'counter' else histograms.items()) if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {PREFIX}{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            for key, value in series:
+                if kind == 'counter':
+                    lines.append(f'{PREFIX}{name}{_format_labels(key, extra)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, value['buckets']):
+                    cumulative += count
+                    lines.append(f'{PREFIX}{name}_bucket{_format_labels(key, extra + (("le", bound),))} {cumulative}')
+                lines.append(f'{PREFIX}{name}_bucket{_format_labels(key, extra + (("le", "+Inf"),))} {value["count"]}')
+                lines.append(f'{PREFIX}{name}_sum{_format_labels(key, extra)} {_format_value(value["sum"])}')
+                lines.append(f'{PREFIX}{name}_count{_format_labels(key, extra)} {value["count"]}')
+        now = time.time()
+        lines.append(f'# HELP {PREFIX}run_duration_seconds Wall time of the last run')
+        lines.append(f'# TYPE {PREFIX}run_duration_seconds gauge')
+        lines.append(f'{PREFIX}run_duration_seconds{_format_labels((), extra)} {_format_value(now - started)}')
+        lines.append(f'# HELP {PREFIX}last_run_timestamp_seconds When the last run finished')
+        lines.append(f'# TYPE {PREFIX}last_run_timestamp_seconds gauge')
+        lines.append(f'{PREFIX}last_run_timestamp_seconds{_format_labels((), extra)} {int(now)}')
+        return lines
+
+    def write_report(self, filename, **info):
+        # {timestamp} in the name keeps one report per run
+        filename = filename.format(timestamp=datetime.fromtimestamp(self.started).strftime('%Y%m%d-%H%M%S'))
+        _write_atomic(filename, json.dumps(self.report(**info), indent=2))
+        return filename
+
+    def write_prometheus(self, filename, **labels):
+        # For node_exporter's textfile collector, which must never read a
+        # half-written file, hence the rename
+        _write_atomic(filename, '\n'.join(self.prometheus_lines(**labels)) + '\n')
+        return filename
+
+def _write_atomic(filename, text):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_filename, filename)
+
+metrics = Metrics()
+
+@contextmanager
+def recorded_run(report_path=None, textfile_path=None, **labels):
+    # Starts a fresh run and writes the configured exports when it ends,
+    # even if it failed
+    metrics.reset()
+    try:
+        yield metrics
+    finally:
+        if report_path:
+            metrics.write_report(report_path, **labels)
+        if textfile_path:
+            metrics.write_prometheus(textfile_path, **labels)
+
+def recorded(func, report_path=None, textfile_path=None, **labels):
+    # Wraps a run entry point such as a GUI worker thread target
+    def run(*args, **kwargs):
+        with recorded_run(report_path, textfile_path, **labels):
+            return func(*args, **kwargs)
+    return run
@@ -0,0 +1,153 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILES_DIRNAME = 'profiles'
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 10
+
+# Before 3.12 cProfile only sees the thread that enabled it, so every thread
+# started during a phase gets its own profiler; from 3.12 one profiler sees
+# all threads and a second one cannot be enabled
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# Frames from the profiler itself are left out of the allocation reports
+ALLOCATION_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+]
+
+_active = None
+
+def profile_directory(base, script):
+    return os.path.join(base, PROFILES_DIRNAME, f"{script}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+class RunProfiler:
+    # cProfile and tracemalloc over one run, split into phases (setup, fetch,
+    # export, action). Each phase writes <phase>.prof for pstats/snakeviz,
+    # <phase>.txt with the top functions by cumulative and own time, and
+    # <phase>-memory.txt with the allocation sites that grew during it.
+    # Decode worker processes are not profiled.
+    def __init__(self, directory):
+        self.directory = directory
+        self.thread = threading.get_ident()
+        self.phase = None
+        self.profile = None
+        self.thread_profiles = []
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg):
+        # First event of a thread started during the phase; the thread's own
+        # profiler replaces this hook
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def start_phase(self, name):
+        self.finish_phase()
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.phase = name if self.counts[name] == 1 else f'{name}-{self.counts[name]}'
+        self.snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self.started = time.monotonic()
+        if PER_THREAD_PROFILES:
+            threading.setprofile(self._profile_thread)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def finish_phase(self):
+        if self.phase is None:
+            return
+        self.profile.disable()
+        if PER_THREAD_PROFILES:
+            threading.setprofile(None)
+        elapsed = time.monotonic() - self.started
+        # Memory is measured before the stats below allocate their own
+        peak = tracemalloc.get_traced_memory()[1]
+        growth = tracemalloc.take_snapshot().filter_traces(ALLOCATION_FILTERS).compare_to(self.snapshot.filter_traces(ALLOCATION_FILTERS), 'lineno')
+        with self.lock:
+            profiles = [self.profile] + self.thread_profiles
+            self.thread_profiles = []
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # A thread that made no calls
+                continue
+        self._write(stats, growth, elapsed, peak)
+        self.phase = None
+
+    def _write(self, stats, growth, elapsed, peak):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.phase)
+        if stats is not None:
+            stats.dump_stats(base + '.prof')
+            text = io.StringIO()
+            text.write(f"Phase {self.phase}: {elapsed:.2f}s wall\n\n")
+            stats.stream = text
+            stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+        with open(base + '-memory.txt', 'w', encoding='utf-8') as f:
+            f.write(f"Phase {self.phase}: peak traced memory {peak / 1024 / 1024:.1f} MB\n\n")
+            f.write(f"Top {TOP_ALLOCATIONS} allocation sites by growth:\n")
+            for stat in growth[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        with open(os.path.join(self.directory, 'summary.txt'), 'a', encoding='utf-8') as f:
+            f.write(f"{self.phase:<12}{elapsed:>10.2f}s  peak {peak / 1024 / 1024:.1f} MB\n")
+
+@contextmanager
+def profiled_run(directory):
+    # Profiles everything until the block ends, starting with a 'setup'
+    # phase; profile_phase() moves on to the next one. Without a directory,
+    # or while another run is profiled, this does nothing.
+    global _active
+    if not directory or _active is not None:
+        yield None
+        return
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler = RunProfiler(directory)
+    _active = profiler
+    profiler.start_phase('setup')
+    try:
+        yield profiler
+    finally:
+        profiler.finish_phase()
+        _active = None
+        if started_tracing:
+            tracemalloc.stop()
+        logging.info(f"Profiles written to {directory}")
+
+def profile_phase(name):
+    # Only the thread running the profiled job switches phases
+    profiler = _active
+    if profiler is not None and profiler.thread == threading.get_ident():
+        profiler.start_phase(name)
+
+def profiled(func, directory):
+    # Wraps a run entry point such as a GUI worker thread target
+    def run(*args, **kwargs):
+        with profiled_run(directory):
+            return func(*args, **kwargs)
+    return run
@@ -0,0 +1,64 @@
+import threading
+import time
+
+# A bus emits at most one event per interval, plus one when a stage finishes
+DEFAULT_INTERVAL = 0.25
+
+def format_eta(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+class ProgressBus:
+    # Collects per-stage counters from the fetch, export and action loops
+    # and hands a coalesced event to `emit`: the stage, done/total, a
+    # percentage, throughput in messages/s and an ETA. Callers can report
+    # every message; the GUI queue or the console only sees a few updates
+    # a second. Safe to call from worker threads.
+    def __init__(self, emit, interval=DEFAULT_INTERVAL):
+        self.emit = emit
+        self.interval = interval
+        self.stages = {}
+        self.last_emit = 0
+        # A stage's rate is measured from the end of the previous stage (or
+        # the creation of the bus), so work before its first report counts
+        self.mark = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, stage, done, total, start=0, span=100):
+        # The stage's share of the overall bar runs from start to start + span
+        now = time.monotonic()
+        with self.lock:
+            counter = self.stages.get(stage)
+            if counter is None or done < counter['done']:
+                counter = self.stages[stage] = {'started': self.mark, 'done': done, 'total': total}
+            counter['done'] = done
+            counter['total'] = total
+            finished = bool(total) and done >= total
+            if finished:
+                self.mark = now
+            if not finished and now - self.last_emit < self.interval:
+                return
+            self.last_emit = now
+            elapsed = now - counter['started']
+            rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate and total else None
+        self.emit({
+            'stage': stage,
+            'done': done,
+            'total': total,
+            'percent': start + (min(done / total, 1) * span if total else 0),
+            'rate': rate,
+            'eta': eta,
+            'message': f"{stage} {done}/{total} emails ({rate:.0f}/s, ETA {format_eta(eta)})"
+        })
+
+def queue_emitter(progress_queue):
+    # Feeds the GUI's ('progress', value, message) queue
+    return lambda event: progress_queue.put(('progress', event['percent'], event['message']))
+
+def print_emitter(event):
+    print(event['message'], end='\r', flush=True)
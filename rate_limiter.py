@@ -0,0 +1,119 @@
+import logging
+import random
+import threading
+import time
+from googleapiclient.errors import HttpError
+from metrics import metrics
+
+# Quota units charged by Gmail for each users.messages / users.history method
+QUOTA_UNITS = {
+    'list': 5,
+    'get': 5,
+    'modify': 5,
+    'trash': 5,
+    'batchModify': 50,
+    'batchDelete': 50,
+    'attachments.get': 5,
+    'history.list': 2,
+    'getProfile': 1,
+}
+
+# Gmail allows 15,000 quota units per user per minute
+DEFAULT_UNITS_PER_SECOND = 250
+
+RETRYABLE_STATUSES = [429, 500, 503]
+
+class RateLimiter:
+    # Token bucket shared by every thread that talks to the API. Tokens are
+    # quota units; a 429 or Retry-After pauses all callers together so they
+    # resume at the ceiling instead of each backing off on its own.
+    def __init__(self, units_per_second=DEFAULT_UNITS_PER_SECOND, burst=None):
+        self.rate = units_per_second
+        self.capacity = burst or units_per_second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, method, count=1):
+        units = QUOTA_UNITS.get(method, 5) * count
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    # Requests larger than the bucket go through once it is
+                    # full and leave it in debt, which throttles what follows
+                    if self.tokens >= min(units, self.capacity):
+                        self.tokens -= units
+                        break
+                    wait = (min(units, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+        # Every acquire is a request about to be sent, retries included
+        metrics.inc('api_calls_total', count, method=method)
+        metrics.inc('quota_units_total', units, method=method)
+        if waited:
+            metrics.inc('rate_limit_wait_seconds_total', waited)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+limiter = RateLimiter()
+
+def is_retryable(error):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status in RETRYABLE_STATUSES:
+        return True
+    # Gmail reports per-user rate limits as 403 rateLimitExceeded
+    content = getattr(error, 'content', b'') or b''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    return status == 403 and 'ratelimitexceeded' in content.lower()
+
+def record_error(error, method, retried):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if is_retryable(error) and status in (403, 429):
+        metrics.inc('api_rate_limited_total', method=method)
+    metrics.inc('api_retries_total' if retried else 'api_errors_total', method=method, status=status or 'none')
+
+def retry_delay(error, attempt):
+    retry_after = None
+    resp = getattr(error, 'resp', None)
+    if resp is not None and hasattr(resp, 'get'):
+        retry_after = resp.get('retry-after')
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = 2 ** attempt
+    return delay + random.uniform(0, 1)
+
+def execute_request(request, method, max_retries=3, rate_limiter=None):
+    rate_limiter = rate_limiter or limiter
+    for attempt in range(max_retries):
+        rate_limiter.acquire(method)
+        started = time.monotonic()
+        try:
+            return request.execute()
+        except HttpError as error:
+            retry = is_retryable(error) and attempt < max_retries - 1
+            record_error(error, method, retry)
+            if retry:
+                delay = retry_delay(error, attempt)
+                logging.warning(f"API error {error.resp.status} on {method}, retrying in {delay:.1f}s")
+                rate_limiter.pause(delay)
+                continue
+            raise
+        except Exception:
+            metrics.inc('api_errors_total', method=method, status='none')
+            raise
+        finally:
+            metrics.observe('api_request_seconds', time.monotonic() - started, method=method)
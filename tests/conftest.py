@@ -0,0 +1,28 @@
+import os
+import sys
+import pytest
+
+# The modules sit at the top of the repository, next to the scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import BUILD_MODULES
+from fake_gmail import FakeLatency, SyntheticMailbox, fake_build
+
+SENDERS = ('news@example.com', 'orders@shop.com')
+
+@pytest.fixture
+def mailbox():
+    # Messages alternate between the two senders, newest first
+    return SyntheticMailbox(40, senders=SENDERS, body_bytes=200, attachment_ratio=0)
+
+@pytest.fixture
+def build(mailbox, monkeypatch):
+    # Every Gmail client the code builds answers from the synthetic mailbox
+    build = fake_build(mailbox, FakeLatency(request=0, per_item=0, jitter=0))
+    for name in BUILD_MODULES:
+        monkeypatch.setattr(f'{name}.build', build)
+    return build
+
+@pytest.fixture
+def service(build):
+    return build('gmail', 'v1')
@@ -0,0 +1,29 @@
+from datetime import date
+from batch_jobs import build_sender_queries, iter_batch_pages, match_sender, unique_senders
+
+def test_sender_queries_are_grouped_with_dates():
+    queries = build_sender_queries(['a@x.com', 'b@x.com', 'Team Y'], date(2024, 1, 1), date(2024, 2, 1), max_senders=2)
+    assert queries == [
+        'from:(a@x.com OR b@x.com) after:2024/01/01 before:2024/02/01',
+        'from:("Team Y") after:2024/01/01 before:2024/02/01',
+    ]
+
+def test_unique_senders_ignores_case():
+    assert unique_senders(['A@x.com', 'a@x.com', 'b@x.com']) == ['A@x.com', 'b@x.com']
+
+def test_longest_sender_match_wins():
+    senders = ['shop.com', 'orders@shop.com']
+    assert match_sender('Shop <Orders@Shop.com>', senders) == 'orders@shop.com'
+    assert match_sender('Other <news@example.com>', senders) is None
+
+def test_batch_pages_drop_repeated_ids(service):
+    queries = ['from:(news@example.com OR orders@shop.com)', 'from:(news@example.com)']
+    pages = list(iter_batch_pages(service, queries))
+    ids = [msg['id'] for page in pages for msg in page['messages']]
+    assert len(ids) == len(set(ids)) == 40
+    assert pages[0]['nextPageToken'] == '1:'
+    assert not pages[-1].get('nextPageToken')
+
+def test_failed_listing_ends_on_next_token(service, monkeypatch):
+    monkeypatch.setattr('batch_jobs.iter_message_pages', lambda *args, **kwargs: iter([]))
+    assert list(iter_batch_pages(service, ['from:(news@example.com)', 'from:(orders@shop.com)'])) == []
@@ -0,0 +1,61 @@
+import os
+import pytest
+from exporters import CsvIdIndex, CsvStreamWriter, JsonlReader, JsonlWriter
+
+def write_csv(filename, ids, preamble=None):
+    with CsvStreamWriter(filename, ['id', 'subject'], preamble) as writer:
+        for msg_id in ids:
+            writer.write({'id': msg_id, 'subject': f'subject {msg_id}'})
+
+def test_csv_ids_found_below_preamble(tmp_path):
+    filename = str(tmp_path / 'emails.csv')
+    write_csv(filename, ['1', '2'], lambda: ['Sender: news@example.com', 'Total Emails: 2'])
+    index = CsvIdIndex()
+    assert index.read(filename) == {'1', '2'}
+    # Appended rows are read from where the last read stopped
+    write_csv(filename, ['3'])
+    assert index.read(filename) == {'1', '2', '3'}
+
+def test_csv_ids_reread_after_truncation(tmp_path):
+    filename = str(tmp_path / 'emails.csv')
+    write_csv(filename, ['1'])
+    size = os.path.getsize(filename)
+    write_csv(filename, ['2'])
+    index = CsvIdIndex()
+    assert index.read(filename) == {'1', '2'}
+    os.truncate(filename, size)
+    assert index.read(filename) == {'1'}
+
+def test_csv_ids_without_key_column(tmp_path):
+    filename = tmp_path / 'other.csv'
+    filename.write_text('name,subject\nx,y\n', encoding='utf-8')
+    assert CsvIdIndex().read(str(filename)) == set()
+    assert CsvIdIndex().read(str(tmp_path / 'missing.csv')) == set()
+
+@pytest.mark.parametrize('name', ['emails.jsonl', 'emails.jsonl.gz'])
+def test_jsonl_reader_indexes(tmp_path, name):
+    filename = str(tmp_path / name)
+    with JsonlWriter(filename) as writer:
+        for n in range(3):
+            writer.write({'n': n})
+    reader = JsonlReader(filename)
+    assert len(reader) == 3
+    assert reader[1] == {'n': 1}
+    assert reader[-1] == {'n': 2}
+    assert [record['n'] for record in reader.iter_from(1)] == [1, 2]
+    with pytest.raises(IndexError):
+        reader[3]
+    with pytest.raises(IndexError):
+        reader[-4]
+
+@pytest.mark.parametrize('name', ['emails.jsonl', 'emails.jsonl.gz'])
+def test_failed_jsonl_export_keeps_previous_file(tmp_path, name):
+    filename = str(tmp_path / name)
+    with JsonlWriter(filename) as writer:
+        writer.write({'n': 0})
+    with pytest.raises(RuntimeError):
+        with JsonlWriter(filename) as writer:
+            writer.write({'n': 1})
+            raise RuntimeError('fetch failed')
+    assert list(JsonlReader(filename)) == [{'n': 0}]
+    assert os.listdir(tmp_path) == [name]
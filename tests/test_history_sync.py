@@ -0,0 +1,44 @@
+from fake_gmail import FakeResource, http_error
+from history_sync import iter_sync_pages
+
+QUERY = 'from:news@example.com'
+
+def history_of(service, handler):
+    # Replaces history.list on one client; handler builds the response
+    users = service.users
+
+    def patched_users():
+        resource = users()
+        resource.history = lambda: FakeResource(
+            list=lambda userId, startHistoryId, **kwargs: service._request('history.list', handler))
+        return resource
+
+    service.users = patched_users
+
+def test_nothing_new_gives_one_empty_page(service):
+    pages = list(iter_sync_pages(service, 'news@example.com', QUERY, start_history_id='1'))
+    assert pages == [{'messages': [], 'resultSizeEstimate': 0}]
+
+def test_only_added_messages_from_sender(service, mailbox):
+    # Even indexes are from news@, odd ones from orders@
+    added = [{'id': mailbox.message_id(n), 'labelIds': ['INBOX']} for n in (0, 1, 2)]
+    added.append({'id': mailbox.message_id(4), 'labelIds': ['SPAM']})
+    history_of(service, lambda: {'history': [{'messagesAdded': [{'message': msg} for msg in added]}]})
+    pages = list(iter_sync_pages(service, 'news@example.com', QUERY, start_history_id='1'))
+    assert [[msg['id'] for msg in page['messages']] for page in pages] == [[mailbox.message_id(0), mailbox.message_id(2)]]
+
+def test_expired_history_lists_whole_query(service):
+    def expired():
+        raise http_error(404, 'notFound')
+
+    history_of(service, expired)
+    pages = list(iter_sync_pages(service, 'news@example.com', QUERY, start_history_id='1'))
+    assert sum(len(page['messages']) for page in pages) == 20
+    assert not pages[-1].get('nextPageToken')
+
+def test_failed_metadata_lists_whole_query(service, mailbox):
+    # An id past the end of the mailbox answers 404 to messages.get
+    added = [{'id': mailbox.message_id(0)}, {'id': mailbox.message_id(mailbox.count)}]
+    history_of(service, lambda: {'history': [{'messagesAdded': [{'message': msg} for msg in added]}]})
+    pages = list(iter_sync_pages(service, 'news@example.com', QUERY, start_history_id='1'))
+    assert sum(len(page['messages']) for page in pages) == 20
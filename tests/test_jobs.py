@@ -0,0 +1,124 @@
+import json
+import os
+from exporters import CsvIdIndex
+from history_sync import STATE_FILENAME, load_checkpoint, save_checkpoint
+from jobs import JobJournal, SenderExport, job_path, unfetched
+
+CSV_FIELDS = ['id', 'from', 'subject']
+
+def parse_message(message):
+    headers = {header['name']: header['value'] for header in message['payload']['headers']}
+    return {'id': message['id'], 'from': headers.get('From', ''), 'subject': headers.get('Subject', '')}
+
+def write_pages(journal, pages, output):
+    # Stands in for the fetch stage: every listed message becomes one line
+    with open(output, 'a', encoding='utf-8') as f:
+        for page in journal.track(iter(pages), set()):
+            for msg in page.get('messages', []):
+                f.write(msg['id'] + '\n')
+                f.flush()
+                journal.record_written(msg['id'])
+
+def test_journal_resume_cuts_outputs_back_to_last_page(tmp_path):
+    output = str(tmp_path / 'out.csv')
+    path = job_path(str(tmp_path), 'news@example.com', 'from:news@example.com')
+    pages = [
+        {'messages': [{'id': 'a'}, {'id': 'b'}], 'nextPageToken': 't1'},
+        {'messages': [{'id': 'c'}], 'nextPageToken': 't2'},
+    ]
+    with JobJournal(path, [output]) as journal:
+        write_pages(journal, pages, output)
+    # The run is killed while writing the next page and its journal line
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write('d\npart')
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"ids": ["d"], "ne')
+
+    with JobJournal(path, [output]) as journal:
+        assert journal.resumed
+        assert [msg['id'] for msg in journal.listed] == ['a', 'b', 'c']
+        assert journal.page_token == 't2'
+        assert not journal.listing_done
+        with open(output, encoding='utf-8') as f:
+            assert f.read() == 'a\nb\nc\n'
+
+def test_journal_of_finished_listing_lists_nothing_again(tmp_path):
+    output = str(tmp_path / 'out.csv')
+    path = str(tmp_path / 'jobs' / 'job.jsonl')
+    with JobJournal(path, [output]) as journal:
+        write_pages(journal, [{'messages': [{'id': 'a'}]}], output)
+        journal.complete()
+    with JobJournal(path, [output]) as journal:
+        assert journal.listing_done
+        assert list(journal.track(iter([{'messages': [{'id': 'b'}]}]), set())) == []
+        assert [msg['id'] for msg in journal.messages([])] == ['a']
+        journal.finish()
+    assert not os.path.exists(path)
+
+def test_journal_removes_outputs_created_after_last_page(tmp_path):
+    output = str(tmp_path / 'out.csv')
+    path = str(tmp_path / 'jobs' / 'job.jsonl')
+    JobJournal(path, [output]).open().__exit__(None, None, None)
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write('a\n')
+    with JobJournal(path, [output]) as journal:
+        assert journal.resumed
+        assert journal.listed == []
+    assert not os.path.exists(output)
+
+def test_unfetched_leaves_out_exported_and_fetched_ids():
+    listed = [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+    assert unfetched(listed, {'a'}, ['b']) == {'c'}
+
+def run_export(service, csv_filename, config, **kwargs):
+    export = SenderExport(object(), service, 'news@example.com', 'from:news@example.com', csv_filename, CSV_FIELDS, config, **kwargs)
+    export.fetch(parse_message, 'full')
+    export.finish()
+    return export
+
+def csv_rows(csv_filename):
+    with open(csv_filename, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+def test_export_skips_ids_already_in_csv_below_preamble(service, tmp_path):
+    # Advanced_Email_extractor writes a "Sender / Total Emails" row above the header
+    csv_filename = str(tmp_path / 'emails.csv')
+    preamble = ['Sender: news@example.com', 'Total Emails: 20']
+    first = run_export(service, csv_filename, {'fetch_workers': 2}, preamble=preamble)
+    assert len(first.new_ids) == 20
+    rows = csv_rows(csv_filename)
+    assert rows[0] == ','.join(preamble)
+    assert len(rows) == 22
+
+    second = run_export(service, csv_filename, {'fetch_workers': 2}, preamble=preamble)
+    assert len(second.messages) == 20
+    assert second.new_ids == []
+    assert csv_rows(csv_filename) == rows
+    assert CsvIdIndex().read(csv_filename) == set(first.new_ids)
+
+def test_empty_incremental_run_advances_checkpoint(service, mailbox, tmp_path):
+    csv_filename = str(tmp_path / 'emails.csv')
+    state_file = str(tmp_path / STATE_FILENAME)
+    config = {'incremental': True, 'fetch_workers': 2}
+    # The first run has no checkpoint, so it lists the whole query
+    first = run_export(service, csv_filename, config)
+    assert len(first.new_ids) == 20
+    assert load_checkpoint(state_file, 'news@example.com') == '40'
+
+    # The mailbox moves on without anything new from the sender
+    mailbox.count += 1
+    second = run_export(service, csv_filename, config)
+    assert second.messages == []
+    assert load_checkpoint(state_file, 'news@example.com') == '41'
+    assert not os.listdir(tmp_path / 'jobs')
+
+def test_failed_listing_keeps_checkpoint(service, tmp_path, monkeypatch):
+    csv_filename = str(tmp_path / 'emails.csv')
+    state_file = str(tmp_path / STATE_FILENAME)
+    save_checkpoint(state_file, 'news@example.com', '5')
+    # History and the fallback listing both fail
+    monkeypatch.setattr('jobs.iter_sync_pages', lambda *args, **kwargs: iter([]))
+    export = run_export(service, csv_filename, {'incremental': True})
+    assert not export.journal.listing_done
+    with open(state_file, encoding='utf-8') as f:
+        assert json.load(f) == {'news@example.com': '5'}
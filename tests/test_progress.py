@@ -0,0 +1,32 @@
+import time
+from progress import ProgressBus, format_eta
+from rate_limiter import RateLimiter
+
+def test_format_eta():
+    assert format_eta(None) == '?'
+    assert format_eta(75) == '1:15'
+    assert format_eta(3725) == '1:02:05'
+
+def test_bus_coalesces_until_stage_finishes():
+    events = []
+    bus = ProgressBus(events.append, interval=60)
+    for done in range(1, 11):
+        bus.update('Fetching', done, 10, start=10, span=50)
+    # The first report and the last one get through
+    assert [event['done'] for event in events] == [1, 10]
+    assert events[-1]['percent'] == 60
+
+def test_limiter_waits_once_burst_is_spent():
+    limiter = RateLimiter(units_per_second=100, burst=5)
+    started = time.monotonic()
+    limiter.acquire('get')
+    assert time.monotonic() - started < 0.04
+    limiter.acquire('get')
+    assert time.monotonic() - started >= 0.04
+
+def test_limiter_pause_holds_callers():
+    limiter = RateLimiter(units_per_second=1000)
+    limiter.pause(0.05)
+    started = time.monotonic()
+    limiter.acquire('getProfile')
+    assert time.monotonic() - started >= 0.04